@@ -0,0 +1,69 @@
+import time
+import numpy as np
+import pandas as pd
+import click
+from pipeline.utils import fan_out
+
+
+def legacy_fan_out(df_tweets, df_texts, value_columns):
+    """row by row join on id, as translate_dataframe and predict_sentiment did before fan_out"""
+    for ix, row in df_tweets.iterrows():
+        df_texts_ = df_texts[df_texts['id'] == row['id']]
+        if len(df_texts_) > 0:
+            for column in value_columns:
+                df_tweets.at[ix, column] = df_texts_[column].values[0]
+    return df_tweets
+
+
+def synthetic_messages(n_rows, duplicate_fraction, seed=2018):
+    """messages with unique ids, of which duplicate_fraction repeat the text of another message"""
+    rng = np.random.RandomState(seed)
+    n_texts = max(1, int(n_rows * (1 - duplicate_fraction)))
+    texts = np.array([f"message {ix} " + "x" * rng.randint(100) for ix in range(n_texts)], dtype=object)
+    text_ix = np.concatenate([np.arange(n_texts), rng.randint(n_texts, size=n_rows - n_texts)])
+    return pd.DataFrame({"id": np.arange(n_rows), "text": texts[rng.permutation(text_ix)]})
+
+
+def score(df_texts):
+    """stand-in for the model: deterministic values per text"""
+    df_texts["sentiment_score"] = df_texts["text"].str.len() / 100.
+    df_texts["sentiment_magnitude"] = df_texts["text"].str.count("x") / 100.
+    return df_texts
+
+
+@click.command()
+@click.option('--n-rows', default=100000, help='number of messages')
+@click.option('--duplicate-fraction', default=0.3, help='fraction of messages repeating another text')
+@click.option('--legacy-rows', default=10000, help='number of messages joined with the legacy loop (quadratic)')
+def main(n_rows, duplicate_fraction, legacy_rows):
+    """time the fan-out of per-text results to messages and check it against the legacy join"""
+    columns = ["sentiment_score", "sentiment_magnitude"]
+    df_tweets = synthetic_messages(n_rows, duplicate_fraction)
+    df_texts = score(df_tweets.drop_duplicates(subset=["text"]).copy())
+
+    start = time.time()
+    df_new = fan_out(df_tweets.copy(), df_texts, "text", columns)
+    print(f'fan_out: {n_rows} rows in {time.time() - start:.3f}s')
+
+    df_sample = df_tweets.iloc[:legacy_rows].copy()
+    df_sample_texts = score(df_sample.drop_duplicates(subset=["text"]).copy())
+    start = time.time()
+    df_legacy = legacy_fan_out(df_sample.copy(), df_sample_texts, columns)
+    t_legacy = time.time() - start
+    print(f'legacy: {len(df_sample)} rows in {t_legacy:.3f}s '
+          f'(~{t_legacy * (n_rows / len(df_sample)) ** 2:.0f}s extrapolated to {n_rows} rows)')
+
+    # identical results wherever the legacy join matched, results for duplicate texts too
+    df_new_sample = fan_out(df_sample.copy(), df_sample_texts, "text", columns)
+    matched = df_legacy[columns[0]].notna()
+    identical = df_new_sample[matched][columns].equals(df_legacy[matched][columns])
+    print(f'identical on the {matched.sum()} rows matched by the legacy join: {identical}')
+    print(f'rows with a result: {df_new_sample[columns[0]].notna().sum()} (legacy {matched.sum()}) '
+          f'out of {len(df_sample)}')
+    expected = score(df_new[["text"]].copy())
+    if not identical or not np.allclose(df_new[columns].values, expected[columns].values):
+        raise click.ClickException("fan_out results differ")
+
+
+if __name__ == "__main__":
+    main()
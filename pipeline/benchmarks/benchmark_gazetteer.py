@@ -0,0 +1,100 @@
+import os
+import time
+import numpy as np
+import click
+from pipeline.gazetteer import GazetteerMatcher
+
+WORDS = ["vaccine", "clinic", "people", "today", "waiting", "news", "health", "workers", "school", "market",
+         "road", "water", "price", "government", "children", "hospital", "rain", "town", "city", "region"]
+
+
+def load_gazetteer(location_file, location_column, n_locations, seed=2018):
+    """location names of the gazetteer file, or synthetic names if the file is not available"""
+    if location_file and os.path.exists(location_file):
+        import geopandas as gpd
+        names = gpd.read_file(location_file, encoding='utf8')[location_column].dropna().str.lower().tolist()
+        print(f'gazetteer: {len(names)} locations from {location_file}')
+        return names
+    rng = np.random.RandomState(seed)
+    syllables = ["ab", "ad", "am", "ar", "ba", "bo", "da", "de", "ga", "go", "ha", "ka", "la", "ma", "me",
+                 "na", "ra", "sa", "se", "ta", "te", "wa", "ye", "zi"]
+    names = [" ".join("".join(rng.choice(syllables, size=rng.randint(2, 5))) for _ in range(rng.randint(1, 3)))
+             for _ in range(n_locations)]
+    print(f'gazetteer: {len(names)} synthetic locations ({location_file or "no file"} not available)')
+    return names
+
+
+def synthetic_texts(names, n_texts, location_fraction, seed=2018):
+    """messages of random words, of which location_fraction name a location, some inside a longer word"""
+    rng = np.random.RandomState(seed)
+    texts = []
+    for _ in range(n_texts):
+        words = list(rng.choice(WORDS, size=rng.randint(5, 30)))
+        if rng.rand() < location_fraction:
+            name = names[rng.randint(len(names))]
+            words.insert(rng.randint(len(words) + 1), name.title() if rng.rand() < 0.5 else name + "s")
+        texts.append(" ".join(words))
+    return texts
+
+
+def legacy_match(texts, locations):
+    """substring loop of match_location before GazetteerMatcher"""
+    results = []
+    for text in texts:
+        loc_match = [loc for loc in locations if loc in text.lower()]
+        results.append(loc_match[0] if len(loc_match) > 0 else None)
+    return results
+
+
+def reference_match(text, locations):
+    """first location found as a whole word, by scanning every occurrence of every location"""
+    text = text.lower()
+    for loc in locations:
+        start = text.find(loc)
+        while start >= 0:
+            end = start + len(loc)
+            if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                return loc
+            start = text.find(loc, start + 1)
+    return None
+
+
+@click.command()
+@click.option('--location-file', default="eth_locations.gpkg", help='gazetteer (e.g. the Ethiopia ADM locations), '
+                                                                    'synthetic if not available')
+@click.option('--location-column', default="ADM_EN", help='column of the location names')
+@click.option('--n-locations', default=5000, help='number of synthetic locations')
+@click.option('--n-texts', default=20000, help='number of messages')
+@click.option('--location-fraction', default=0.3, help='fraction of messages naming a location')
+@click.option('--legacy-texts', default=2000, help='number of messages matched with the legacy loop')
+def main(location_file, location_column, n_locations, n_texts, location_fraction, legacy_texts):
+    """time the gazetteer matcher against the legacy substring loop, and check it against a reference"""
+    locations = [name for name in load_gazetteer(location_file, location_column, n_locations) if name.strip()]
+    texts = synthetic_texts(locations, n_texts, location_fraction)
+
+    start = time.time()
+    matcher = GazetteerMatcher(locations)
+    print(f'build: {len(matcher)} names in {time.time() - start:.3f}s')
+    start = time.time()
+    matches = matcher.match_many(texts)
+    t_matcher = time.time() - start
+    print(f'matcher: {n_texts} messages in {t_matcher:.3f}s')
+
+    start = time.time()
+    legacy = legacy_match(texts[:legacy_texts], locations)
+    t_legacy = time.time() - start
+    print(f'legacy: {legacy_texts} messages in {t_legacy:.3f}s '
+          f'(~{t_legacy * n_texts / legacy_texts:.1f}s extrapolated to {n_texts} messages, '
+          f'speedup x{t_legacy * n_texts / legacy_texts / t_matcher:.0f})')
+
+    # the legacy loop also matches inside longer words, the matcher only matches whole words
+    same = sum(new == old for new, old in zip(matches, legacy))
+    print(f'same location as legacy: {same} / {legacy_texts}, matched: {sum(m is not None for m in matches[:legacy_texts])}'
+          f' (legacy {sum(m is not None for m in legacy)})')
+    reference = [reference_match(text, locations) for text in texts[:legacy_texts]]
+    if matches[:legacy_texts] != reference:
+        raise click.ClickException("matcher results differ from the whole-word reference")
+
+
+if __name__ == "__main__":
+    main()
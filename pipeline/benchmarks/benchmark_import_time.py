@@ -0,0 +1,58 @@
+import subprocess
+import sys
+import click
+
+
+def import_times(module):
+    """
+    Import module in a fresh interpreter with python -X importtime
+    :return: (total seconds, list of (submodule, seconds) imported directly by module, slowest first)
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise click.ClickException(f"cannot import {module}: {result.stderr.strip().splitlines()[-1]}")
+
+    total, children, pending = 0., [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header
+        seconds = int(cumulative) / 1e6
+        # nested imports are indented by two spaces per level and printed before their parent
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 0:
+            total += seconds
+            if name == module:
+                children = pending
+            pending = []
+        elif depth == 1:
+            pending.append((name, seconds))
+    return total, sorted(children, key=lambda child: -child[1])
+
+
+@click.command()
+@click.option('--module', 'modules', default=["pipeline.utils", "pipeline.pipeline"], multiple=True,
+              help='module to import (can be repeated)')
+@click.option('--repeat', default=3, help='number of imports of each module, the fastest is reported')
+@click.option('--top', default=15, help='number of slowest direct imports listed per module')
+@click.option('--max-seconds', default=2.0, help='fail if importing any module takes longer')
+def main(modules, repeat, top, max_seconds):
+    """report the import time of the pipeline modules and fail on regressions"""
+    failed = []
+    for module in modules:
+        total, children = min((import_times(module) for _ in range(repeat)), key=lambda times: times[0])
+        print(f'{module}: {total:.3f}s')
+        for name, seconds in children[:top]:
+            print(f'    {name:<40} {seconds:8.3f}s')
+        if total > max_seconds:
+            failed.append(module)
+    if failed:
+        raise click.ClickException(f"import time above {max_seconds}s: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import time
+import numpy as np
+import pandas as pd
+import click
+from pipeline.utils import load_huggingface_pipeline, detect_sentiment_batch, translate_texts
+from pipeline.executor import RequestExecutor
+
+# fixed sample, repeated up to --n-texts when no --data is given
+SAMPLE_TEXTS = [
+    "I got my first dose of the vaccine today, the nurses were great",
+    "The queue at the clinic was terrible, we waited for five hours",
+    "Not sure the vaccine is safe, my neighbour was sick for a week after",
+    "Thank you to all the health workers in the north for their work",
+    "Why is there no vaccine left in our town when the capital has plenty?",
+    "The minister announced new measures for schools starting next month",
+    "Fake news again about covid on the radio, people please check your sources",
+    "Happy to see my family again after two years",
+]
+
+
+def load_texts(data, text_column, n_texts):
+    if data:
+        texts = pd.read_csv(data)[text_column].dropna().astype(str).tolist()
+    else:
+        texts = [f"{text} ({ix})" for ix, text in enumerate(SAMPLE_TEXTS * (n_texts // len(SAMPLE_TEXTS) + 1))]
+    return texts[:n_texts]
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start
+
+
+def benchmark_sentiment(model, texts, batch_size, config):
+    results, seconds = {}, {}
+    for quantize in (False, True):
+        nlp_client = load_huggingface_pipeline('sentiment-analysis', model, dict(config, **{"quantize-models": quantize}))
+        detect_sentiment_batch(texts[:batch_size], nlp_client, batch_size)  # warm-up
+        results[quantize], seconds[quantize] = timed(detect_sentiment_batch, texts, nlp_client, batch_size)
+    scores = {quantize: np.array([score for score, _ in results[quantize]]) for quantize in results}
+    magnitudes = {quantize: np.array([magnitude for _, magnitude in results[quantize]]) for quantize in results}
+    print(f'sentiment ({model}): fp32 {seconds[False]:.2f}s, int8 {seconds[True]:.2f}s, '
+          f'speedup x{seconds[False] / seconds[True]:.2f}')
+    print(f'    score: mean absolute difference {np.abs(scores[True] - scores[False]).mean():.4f}, '
+          f'same sign {(np.sign(scores[True]) == np.sign(scores[False])).mean() * 100:.1f}%')
+    print(f'    magnitude: mean absolute difference {np.abs(magnitudes[True] - magnitudes[False]).mean():.4f}')
+
+
+def benchmark_translation(model, texts, batch_size, config):
+    results, seconds = {}, {}
+    for quantize in (False, True):
+        translate_client = load_huggingface_pipeline('translation', model, dict(config, **{"quantize-models": quantize}))
+        executor = RequestExecutor(max_workers=1)
+        translate_texts(texts[:batch_size], translate_client, model, batch_size, np.inf, executor)  # warm-up
+        results[quantize], seconds[quantize] = timed(translate_texts, texts, translate_client, model,
+                                                     batch_size, np.inf, executor)
+    identical = np.mean([fp32 == int8 for fp32, int8 in zip(results[False], results[True])])
+    fp32_tokens = [set(text.lower().split()) for text in results[False]]
+    int8_tokens = [set(text.lower().split()) for text in results[True]]
+    overlap = np.mean([len(a & b) / max(1, len(a | b)) for a, b in zip(fp32_tokens, int8_tokens)])
+    print(f'translation ({model}): fp32 {seconds[False]:.2f}s, int8 {seconds[True]:.2f}s, '
+          f'speedup x{seconds[False] / seconds[True]:.2f}')
+    print(f'    identical translations {identical * 100:.1f}%, mean word overlap (Jaccard) {overlap:.3f}')
+
+
+@click.command()
+@click.option('--sentiment-model', default="HuggingFace:finiteautomata/bertweet-base-sentiment-analysis",
+              help='HuggingFace sentiment model, none if empty')
+@click.option('--translation-model', default="", help='HuggingFace translation model, none if empty, '
+                                                      'e.g. HuggingFace:Helsinki-NLP/opus-mt-fr-en')
+@click.option('--data', default="", help='csv file with the texts, the built-in (english) sample if empty')
+@click.option('--text-column', default="text", help='column of the texts in --data')
+@click.option('--n-texts', default=256, help='number of texts')
+@click.option('--batch-size', default=32, help='number of texts per batch')
+@click.option('--threads', default=None, type=int, help='torch intra-op threads, all cores if not given')
+def main(sentiment_model, translation_model, data, text_column, n_texts, batch_size, threads):
+    """compare the speed and the results of fp32 and int8 dynamically quantized models on a fixed sample"""
+    config = {} if threads is None else {"torch-threads": threads}
+    texts = load_texts(data, text_column, n_texts)
+    if sentiment_model:
+        benchmark_sentiment(sentiment_model, texts, batch_size, config)
+    if translation_model:
+        benchmark_translation(translation_model, texts, batch_size, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,8 @@ setuptools.setup(
     extras_require={
         "dev": [  # Place NON-production dependencies in this list - so for DEVELOPMENT ONLY!
             "black",
-            "flake8"
+            "flake8",
+            "pytest"
         ],
     },
     entry_points={
@@ -1,14 +1,349 @@
 import os
+import heapq
+import struct
+import zipfile
 import operator
 import numpy as np
+from collections import Counter
+from math import lgamma
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from numpy.random import multinomial
 from numpy import log, exp
 from numpy import argmax
 
 
+def encode_docs(docs, word2id=None):
+    '''
+    Map the tokens of each document to integer ids
+    :param docs: list of list of str
+    :param word2id: dict, optional
+        existing word to id mapping, extended in place with unseen words
+    :return: (list of int32 arrays, list of words indexed by id)
+    '''
+    if word2id is None:
+        word2id = {}
+    doc_ids = []
+    for doc in docs:
+        ids = np.empty(len(doc), dtype=np.int32)
+        for j, word in enumerate(doc):
+            ids[j] = word2id.setdefault(word, len(word2id))
+        doc_ids.append(ids)
+    id2word = [None] * len(word2id)
+    for word, ix in word2id.items():
+        id2word[ix] = word
+    return doc_ids, id2word
+
+
+class Vocabulary:
+    def __init__(self, words=(), doc_freqs=None, min_df=1, max_df=1.0):
+        '''
+        Integer ids of the words kept for the model, with the number of documents containing each word.
+        Words that are too rare (noise, typos) or too common to separate clusters are pruned,
+        and the documents are encoded once into int32 arrays of word ids.
+        :param words: list of str, indexed by id
+        :param doc_freqs: list of int, document frequency of each word, zeros if None
+        :param min_df: int
+            words in fewer documents are pruned
+        :param max_df: float between 0 and 1
+            words in a larger fraction of the documents are pruned
+        '''
+        self.id2word = list(words)
+        self.word2id = {word: ix for ix, word in enumerate(self.id2word)}
+        self.doc_freqs = list(doc_freqs) if doc_freqs is not None else [0 for _ in self.id2word]
+        self.min_df = min_df
+        self.max_df = max_df
+
+    @staticmethod
+    def from_docs(docs, min_df=1, max_df=1.0):
+        '''
+        Build a pruned vocabulary from tokenized documents
+        :param docs: list of list of str
+        :param min_df: int
+        :param max_df: float
+        :return: Vocabulary
+        '''
+        vocabulary = Vocabulary(min_df=min_df, max_df=max_df)
+        vocabulary.update(docs)
+        return vocabulary
+
+    def update(self, docs):
+        '''
+        Count the document frequencies of new documents. Known words are never pruned, so that ids stay
+        valid for a fitted model; unseen words are added if their document frequency in docs passes
+        min_df and max_df
+        :param docs: list of list of str
+        :return: list of the added words
+        '''
+        doc_freqs = Counter()
+        for doc in docs:
+            doc_freqs.update(list(dict.fromkeys(doc)))
+        max_count = self.max_df * len(docs)
+        added = []
+        for word, count in doc_freqs.items():
+            ix = self.word2id.get(word)
+            if ix is not None:
+                self.doc_freqs[ix] += count
+            elif self.min_df <= count <= max_count:
+                self.word2id[word] = len(self.id2word)
+                self.id2word.append(word)
+                self.doc_freqs.append(count)
+                added.append(word)
+        return added
+
+    def __len__(self):
+        return len(self.id2word)
+
+    def __contains__(self, word):
+        return word in self.word2id
+
+    def filter(self, doc):
+        '''
+        :return: the words of doc in the vocabulary, in order
+        '''
+        return [word for word in doc if word in self.word2id]
+
+    def encode(self, doc):
+        '''
+        :return: int32 array of the ids of the words of doc in the vocabulary
+        '''
+        ids = [self.word2id[word] for word in doc if word in self.word2id]
+        return np.array(ids, dtype=np.int32)
+
+    def encode_docs(self, docs):
+        '''
+        :param docs: list of list of str
+        :return: list of int32 arrays
+        '''
+        return [self.encode(doc) for doc in docs]
+
+
+def _unique_counts(doc_ids):
+    '''
+    Unique word ids and their multiplicity for each encoded document
+    :param doc_ids: list of int arrays
+    :return: (list of unique id arrays, list of count arrays)
+    '''
+    doc_words, doc_counts = [], []
+    for ids in doc_ids:
+        words, counts = np.unique(ids, return_counts=True)
+        doc_words.append(words)
+        doc_counts.append(counts.astype(np.int32))
+    return doc_words, doc_counts
+
+
+def _gibbs_sweep(doc_ids, doc_words, doc_counts, d_z, m_z, n_z, n_z_w, alpha, beta, V, rng=np.random):
+    '''
+    One collapsed Gibbs sweep over encoded documents, updating the count arrays in place.
+    Implements formula (3) of Yin and Wang 2014, as MovieGroupProcess.score
+    :return: int
+        number of documents that changed cluster
+    '''
+    total_transfers = 0
+    lD2_offset = n_z.astype(np.float64)[:, None] + V * beta
+    for i, ids in enumerate(doc_ids):
+        words, counts = doc_words[i], doc_counts[i]
+        doc_size = len(ids)
+
+        # remove the doc from it's current cluster
+        z_old = d_z[i]
+        m_z[z_old] -= 1
+        n_z[z_old] -= doc_size
+        n_z_w[z_old, words] -= counts
+        lD2_offset[z_old, 0] -= doc_size
+
+        # log of the unnormalized probability vector, lD1 is constant over clusters
+        lp = log(m_z + alpha)
+        lp += log(n_z_w[:, ids] + beta).sum(axis=1)
+        lp -= log(lD2_offset + np.arange(doc_size)).sum(axis=1)
+
+        # draw sample from distribution to find new cluster
+        p = exp(lp - lp.max())
+        cdf = np.cumsum(p)
+        z_new = min(int(np.searchsorted(cdf, rng.random_sample() * cdf[-1], side='right')), len(p) - 1)
+
+        # transfer doc to the new cluster
+        if z_new != z_old:
+            total_transfers += 1
+
+        d_z[i] = z_new
+        m_z[z_new] += 1
+        n_z[z_new] += doc_size
+        n_z_w[z_new, words] += counts
+        lD2_offset[z_new, 0] += doc_size
+    return total_transfers
+
+
+# number of training documents kept with the model for partial_fit
+DOC_SAMPLE_SIZE = 2000
+
+# number of most frequent words per cluster kept in the top words index
+TOP_WORDS_SIZE = 20
+
+# version of the .npz format written by FrozenMovieGroupProcess.save
+MODEL_FORMAT_VERSION = 1
+
+
+def _load_npz(path, mmap=True):
+    '''
+    Load the arrays of an uncompressed .npz file.
+    If mmap is True, every array is a read-only memory map of its bytes inside the archive,
+    so that processes loading the same file share one physical copy.
+    :param path: str
+    :param mmap: bool
+    :return: dict of arrays
+    '''
+    if not mmap:
+        with np.load(path, allow_pickle=False) as npz:
+            return {name: npz[name] for name in npz.files}
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{path} is compressed and cannot be memory-mapped")
+            # skip the local file header, whose extra field can differ from the central directory
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", file.read(4))
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[:-len(".npy")]
+            if dtype.hasobject:
+                raise ValueError(f"{path} contains object arrays")
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=file.tell(), shape=shape,
+                                         order="F" if fortran_order else "C")
+    return arrays
+
+
+# encoded shards of the corpus held by each worker process of the parallel sampler
+_shard_corpus = None
+
+
+def _init_shard_worker(shard_corpus):
+    global _shard_corpus
+    _shard_corpus = shard_corpus
+
+
+def _sweep_shard(shard, d_z, m_z, n_z, n_z_w, alpha, beta, V, n_sweeps, seed):
+    '''
+    Run n_sweeps Gibbs sweeps over one shard against a local copy of the global counts
+    :return: (new assignments of the shard, delta of m_z, delta of n_z,
+              (rows, columns, values) of the non-zero delta of n_z_w, number of transfers)
+    '''
+    doc_ids, doc_words, doc_counts = _shard_corpus[shard]
+    m_z_local, n_z_local, n_z_w_local = m_z.copy(), n_z.copy(), n_z_w.copy()
+    rng = np.random.RandomState(seed)
+    total_transfers = 0
+    for _ in range(n_sweeps):
+        total_transfers += _gibbs_sweep(doc_ids, doc_words, doc_counts, d_z, m_z_local, n_z_local, n_z_w_local,
+                                        alpha, beta, V, rng)
+    n_z_w_delta = n_z_w_local - n_z_w
+    rows, cols = np.nonzero(n_z_w_delta)
+    return d_z, m_z_local - m_z, n_z_local - n_z, (rows, cols, n_z_w_delta[rows, cols]), total_transfers
+
+
+def _parallel_sweep(executor, shards, d_z, m_z, n_z, n_z_w, alpha, beta, V, n_sweeps, rng):
+    '''
+    Approximate distributed Gibbs sampling (AD-LDA, Newman et al. 2009):
+    every shard is swept against the same snapshot of the counts, then the deltas are summed.
+    Counts and assignments are updated in place.
+    :return: int
+        number of documents that changed cluster, summed over sweeps
+    '''
+    futures = [executor.submit(_sweep_shard, shard, d_z[docs], m_z, n_z, n_z_w, alpha, beta, V, n_sweeps,
+                               rng.randint(2 ** 31 - 1))
+               for shard, docs in enumerate(shards)]
+    total_transfers = 0
+    for docs, future in zip(shards, futures):
+        d_z_shard, m_z_delta, n_z_delta, (rows, cols, values), transfers = future.result()
+        d_z[docs] = d_z_shard
+        m_z += m_z_delta
+        n_z += n_z_delta
+        n_z_w[rows, cols] += values
+        total_transfers += transfers
+    return total_transfers
+
+
+def _log_likelihood(alpha, beta, K, V, D, m_z, n_z, word_counts):
+    '''
+    Log joint probability log p(d, z) of the Dirichlet Multinomial Mixture model
+    with cluster and word distributions integrated out
+    :param m_z: number of documents per cluster
+    :param n_z: number of words per cluster
+    :param word_counts: array of the non-zero entries of n_z_w
+    :return: float
+    '''
+    m_z = np.asarray(m_z)
+    n_z = np.asarray(n_z)
+    counts, multiplicity = np.unique(np.asarray(word_counts), return_counts=True)
+    ll = lgamma(K * alpha) - lgamma(D + K * alpha)
+    ll += sum(lgamma(m + alpha) for m in m_z) - K * lgamma(alpha)
+    ll += K * lgamma(V * beta) - sum(lgamma(n + V * beta) for n in n_z)
+    ll += sum(c * lgamma(n + beta) for n, c in zip(counts.tolist(), multiplicity.tolist()))
+    ll -= multiplicity.sum() * lgamma(beta)
+    return float(ll)
+
+
+class _ConvergenceMonitor:
+    def __init__(self, tol=None, patience=10, stable_clusters=None):
+        '''
+        Record the state of the sampler after each iteration and decide when to stop.
+        The sampler stops when any of the following holds:
+            1) the number of transfers has been stable (within 10%) for more than 50 iterations
+            2) the relative change of the log-likelihood has been below tol for patience iterations
+            3) the number of populated clusters has not changed for stable_clusters iterations
+        :param tol: float, optional
+        :param patience: int
+        :param stable_clusters: int, optional
+        '''
+        self.tol = tol
+        self.patience = patience
+        self.stable_clusters = stable_clusters
+        self.history = []
+        self.total_transfers_old, self.count_convergence = 1e24, 0
+        self.count_likelihood, self.count_clusters = 0, 0
+
+    def update(self, iteration, transfers, cluster_count, log_likelihood):
+        '''
+        :return: str
+            reason to stop, or None to continue
+        '''
+        previous = self.history[-1] if self.history else None
+        self.history.append({"iteration": iteration,
+                             "log_likelihood": log_likelihood,
+                             "transfers": transfers,
+                             "clusters": cluster_count})
+
+        if abs(transfers - self.total_transfers_old) < 0.1 * 0.5 * (transfers + self.total_transfers_old):
+            self.count_convergence += 1
+        else:
+            self.count_convergence = 0
+        self.total_transfers_old = transfers
+        if self.count_convergence > 50:
+            return "stable number of transfers"
+
+        if previous is None:
+            return None
+        if self.tol is not None:
+            change = abs(log_likelihood - previous["log_likelihood"]) / abs(previous["log_likelihood"])
+            self.count_likelihood = self.count_likelihood + 1 if change < self.tol else 0
+            if self.count_likelihood >= self.patience:
+                return "stable log-likelihood"
+        if self.stable_clusters is not None:
+            self.count_clusters = self.count_clusters + 1 if cluster_count == previous["clusters"] else 0
+            if self.count_clusters >= self.stable_clusters:
+                return "stable number of clusters"
+        return None
+
+
 class MovieGroupProcess:
-    def __init__(self, K=8, alpha=0.1, beta=0.1, n_iters=30):
+    def __init__(self, K=8, alpha=0.1, beta=0.1, n_iters=30, random_state=None, tol=None, patience=10,
+                 stable_clusters=None):
         '''
         A MovieGroupProcess is a conceptual model introduced by Yin and Wang 2014 to
         describe their Gibbs sampling algorithm for a Dirichlet Mixture Model for the
@@ -31,11 +366,22 @@ class MovieGroupProcess:
             that students desire to sit with students of similar interests. A high beta means they are less
             concerned with affinity and are more influenced by the popularity of a table
         :param n_iters:
+        :param random_state: int, optional
+            Seed of the sampler; when None the global numpy random state is used
+        :param tol: float, optional
+            Stop early when the relative change of the log-likelihood stays below tol for patience iterations
+        :param patience: int
+        :param stable_clusters: int, optional
+            Stop early when the number of populated clusters does not change for this many iterations
         '''
         self.K = K
         self.alpha = alpha
         self.beta = beta
         self.n_iters = n_iters
+        self.random_state = random_state
+        self.tol = tol
+        self.patience = patience
+        self.stable_clusters = stable_clusters
 
         # slots for computed variables
         self.number_docs = None
@@ -43,6 +389,10 @@ class MovieGroupProcess:
         self.cluster_doc_count = [0 for _ in range(K)]
         self.cluster_word_count = [0 for _ in range(K)]
         self.cluster_word_distribution = [{} for i in range(K)]
+        self.doc_sample = []
+        self.history = []
+        self.top_words_index = [[] for _ in range(K)]
+        self.vocabulary = None
 
     @staticmethod
     def from_data(K, alpha, beta, D, vocab_size, cluster_doc_count, cluster_word_count, cluster_word_distribution):
@@ -64,29 +414,84 @@ class MovieGroupProcess:
         mgp.cluster_doc_count = cluster_doc_count
         mgp.cluster_word_count = cluster_word_count
         mgp.cluster_word_distribution = cluster_word_distribution
+        mgp._update_top_words()
         return mgp
 
     @staticmethod
-    def _sample(p):
+    def _sample(p, rng=np.random):
         '''
         Sample with probability vector p from a multinomial distribution
         :param p: list
             List of probabilities representing probability vector for the multinomial distribution
+        :param rng: numpy RandomState or the numpy.random module
         :return: int
             index of randomly selected output
         '''
-        return [i for i, entry in enumerate(multinomial(1, p)) if entry != 0][0]
+        return [i for i, entry in enumerate(rng.multinomial(1, p)) if entry != 0][0]
 
-    def fit(self, docs, vocab_size):
+    def _random_state(self, stream=None):
+        '''
+        :param stream: int, optional
+            mixed into the seed, so that each partial_fit draws its own stream rather than replaying the fit's
+        :return: numpy RandomState, or the numpy.random module if the model has no random_state
+        '''
+        # models pickled before random_state existed do not have the attribute
+        random_state = getattr(self, "random_state", None)
+        if random_state is None:
+            return np.random
+        if stream is None:
+            return np.random.RandomState(random_state)
+        return np.random.RandomState([random_state, stream])
+
+    def log_likelihood(self):
+        '''
+        Log joint probability of the documents and their cluster assignments under the fitted model
+        :return: float
+        '''
+        word_counts = [c for distribution in self.cluster_word_distribution for c in distribution.values()]
+        return _log_likelihood(self.alpha, self.beta, self.K, self.vocab_size, self.number_docs,
+                               self.cluster_doc_count, self.cluster_word_count, word_counts)
+
+    def fit(self, docs, vocab_size=None, engine="python", n_jobs=None, sync_every=1, vocabulary=None):
         '''
         Cluster the input documents
         :param docs: list of list
             list of lists containing the unique token set of each document
-        :param V: total vocabulary size for each document
+        :param vocab_size: total vocabulary size,
+            the size of vocabulary or the number of distinct words of docs if None
+        :param engine: str
+            "python" runs the reference sampler on lists and dicts,
+            "numpy" integer-encodes the vocabulary and runs the sampler on count arrays,
+            "parallel" runs the numpy sampler on shards of the documents in n_jobs processes.
+            The numpy samplers compute the K-way conditional of a document in a few array operations,
+            which also makes them the fastest at large K
+        :param n_jobs: int
+            number of processes of the "parallel" engine, all cores if None
+        :param sync_every: int
+            number of sweeps each process of the "parallel" engine runs between count reconciliations
+        :param vocabulary: Vocabulary, optional
+            the words of docs that are not in the vocabulary are ignored. Kept with the model
         :return: list of length len(doc)
-            cluster label for each document
+            cluster label for each document. The iteration, log-likelihood, number of transfers and
+            number of populated clusters after each iteration are stored in self.history
         '''
+        if engine == "numpy":
+            return self._fit_numpy(docs, vocab_size, vocabulary=vocabulary)
+        elif engine == "parallel":
+            return self._fit_numpy(docs, vocab_size, n_jobs or os.cpu_count(), sync_every, vocabulary=vocabulary)
+        elif engine != "python":
+            raise ValueError(f"unknown engine {engine}")
+
+        if vocabulary is not None:
+            docs = [vocabulary.filter(doc) for doc in docs]
+            if vocab_size is None:
+                vocab_size = len(vocabulary)
+        elif vocab_size is None:
+            vocab_size = len(set(word for doc in docs for word in doc))
+        self.vocabulary = vocabulary
+
         alpha, beta, K, n_iters, V = self.alpha, self.beta, self.K, self.n_iters, vocab_size
+        rng = self._random_state()
 
         D = len(docs)
         self.number_docs = D
@@ -94,15 +499,14 @@ class MovieGroupProcess:
 
         # unpack to easy var names
         m_z, n_z, n_z_w = self.cluster_doc_count, self.cluster_word_count, self.cluster_word_distribution
-        cluster_count = K
         d_z = [None for i in range(len(docs))]
-        total_transfers_old, count_convergence = 1e24, 0
+        monitor = _ConvergenceMonitor(self.tol, self.patience, self.stable_clusters)
 
         # initialize the clusters
         for i, doc in enumerate(docs):
 
             # choose a random  initial cluster for the doc
-            z = self._sample([1.0 / K for _ in range(K)])
+            z = self._sample([1.0 / K for _ in range(K)], rng)
             d_z[i] = z
             m_z[z] += 1
             n_z[z] += len(doc)
@@ -133,7 +537,7 @@ class MovieGroupProcess:
 
                 # draw sample from distribution to find new cluster
                 p = self.score(doc)
-                z_new = self._sample(p)
+                z_new = self._sample(p, rng)
 
                 # transfer doc to the new cluster
                 if z_new != z_old:
@@ -149,25 +553,231 @@ class MovieGroupProcess:
                     n_z_w[z_new][word] += 1
 
             cluster_count_new = sum([1 for v in m_z if v > 0])
-            # print("In stage %d: transferred %d clusters with %d clusters populated" % (
-            # _iter, total_transfers, cluster_count_new))
-
-            if abs(total_transfers - total_transfers_old) < 0.1 * 0.5 * (total_transfers+total_transfers_old):
-                count_convergence += 1
-            else:
-                count_convergence = 0
-            if count_convergence > 50:
-                print("Converged.  Breaking out.")
+            self.cluster_count = cluster_count_new
+            converged = monitor.update(_iter + 1, total_transfers, cluster_count_new, self.log_likelihood())
+            if converged:
+                print(f"Converged ({converged}).  Breaking out.")
                 break
-            total_transfers_old = total_transfers
-            # if total_transfers == 0 and cluster_count_new == cluster_count and _iter > 25:
-            #     print("Converged.  Breaking out.")
-            #     break
 
-            self.cluster_count = cluster_count_new
+        self.history = monitor.history
         self.cluster_word_distribution = n_z_w
+        self._sample_docs(docs, d_z, rng)
+        self._update_top_words()
         return d_z
 
+    def _fit_numpy(self, docs, vocab_size, n_jobs=None, sync_every=1, vocabulary=None):
+        if vocabulary is not None:
+            return self.fit_encoded(vocabulary.encode_docs(docs), None, vocab_size, n_jobs, sync_every, vocabulary)
+        doc_ids, id2word = encode_docs(docs)
+        return self.fit_encoded(doc_ids, id2word, vocab_size, n_jobs, sync_every)
+
+    def fit_encoded(self, doc_ids, id2word=None, vocab_size=None, n_jobs=None, sync_every=1, vocabulary=None):
+        '''
+        Same sampler as fit, but on integer-encoded documents and with m_z, n_z and n_z_w stored
+        in numpy arrays so that the K-way conditional of each document is computed at once.
+        If n_jobs is given, the documents are split in n_jobs shards swept in parallel,
+        and the counts are reconciled every sync_every sweeps. The convergence check and the
+        history are then updated once per reconciliation.
+        :param doc_ids: list of int arrays
+            word ids of each document
+        :param id2word: list of words indexed by id, the words of vocabulary if None
+        :param vocab_size: total vocabulary size, len(id2word) if None
+        :param n_jobs: int, optional
+        :param sync_every: int
+        :param vocabulary: Vocabulary, optional
+            vocabulary doc_ids were encoded with, kept with the model
+        :return: list of length len(doc)
+            cluster label for each document
+        '''
+        if id2word is None:
+            id2word = vocabulary.id2word
+        if vocab_size is None:
+            vocab_size = len(id2word)
+        self.vocabulary = vocabulary
+        alpha, beta, K, n_iters, V = self.alpha, self.beta, self.K, self.n_iters, vocab_size
+        rng = self._random_state()
+
+        D = len(doc_ids)
+        self.number_docs = D
+        self.vocab_size = vocab_size
+
+        doc_words, doc_counts = _unique_counts(doc_ids)
+
+        m_z = np.zeros(K, dtype=np.int64)
+        n_z = np.zeros(K, dtype=np.int64)
+        n_z_w = np.zeros((K, len(id2word)), dtype=np.int32)
+        monitor = _ConvergenceMonitor(self.tol, self.patience, self.stable_clusters)
+
+        # initialize the clusters
+        d_z = rng.randint(K, size=D)
+        for i, z in enumerate(d_z):
+            m_z[z] += 1
+            n_z[z] += len(doc_ids[i])
+            n_z_w[z, doc_words[i]] += doc_counts[i]
+
+        executor, shards = None, None
+        if n_jobs is not None:
+            shards = np.array_split(np.arange(D), n_jobs)
+            shard_corpus = [([doc_ids[i] for i in shard], [doc_words[i] for i in shard], [doc_counts[i] for i in shard])
+                            for shard in shards]
+            executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_shard_worker,
+                                           initargs=(shard_corpus,))
+
+        try:
+            _iter = 0
+            while _iter < n_iters:
+                if executor is None:
+                    n_sweeps = 1
+                    total_transfers = _gibbs_sweep(doc_ids, doc_words, doc_counts, d_z, m_z, n_z, n_z_w,
+                                                   alpha, beta, V, rng)
+                else:
+                    n_sweeps = min(sync_every, n_iters - _iter)
+                    total_transfers = _parallel_sweep(executor, shards, d_z, m_z, n_z, n_z_w,
+                                                      alpha, beta, V, n_sweeps, rng) / n_sweeps
+                _iter += n_sweeps
+                cluster_count_new = int((m_z > 0).sum())
+                self.cluster_count = cluster_count_new
+                converged = monitor.update(_iter, total_transfers, cluster_count_new,
+                                           _log_likelihood(alpha, beta, K, V, D, m_z, n_z, n_z_w[n_z_w > 0]))
+                if converged:
+                    print(f"Converged ({converged}).  Breaking out.")
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.history = monitor.history
+
+        self._set_counts(m_z, n_z, n_z_w, id2word)
+        self._sample_docs(doc_ids, d_z.tolist(), rng, id2word=id2word)
+        self._update_top_words()
+        return d_z.tolist()
+
+    def _sample_docs(self, docs, d_z, rng, seen=0, id2word=None):
+        '''
+        Keep a uniform reservoir sample of at most DOC_SAMPLE_SIZE documents and their clusters,
+        used by partial_fit to resample old documents together with new ones
+        :param docs: list of list of str
+        :param d_z: cluster label for each document
+        :param rng: numpy RandomState or the numpy.random module
+        :param seen: number of documents already offered to the reservoir
+        :param id2word: list of words indexed by id, if docs are integer-encoded
+        '''
+        def decode(doc):
+            return list(doc) if id2word is None else [id2word[ix] for ix in doc]
+
+        if seen == 0:
+            self.doc_sample = []
+        for i, doc in enumerate(docs):
+            if len(self.doc_sample) < DOC_SAMPLE_SIZE:
+                self.doc_sample.append((decode(doc), d_z[i]))
+            else:
+                j = rng.randint(seen + i + 1)
+                if j < DOC_SAMPLE_SIZE:
+                    self.doc_sample[j] = (decode(doc), d_z[i])
+
+    def _add_doc(self, doc, z):
+        self.cluster_doc_count[z] += 1
+        self.cluster_word_count[z] += len(doc)
+        for word in doc:
+            self.cluster_word_distribution[z][word] = self.cluster_word_distribution[z].get(word, 0) + 1
+
+    def _remove_doc(self, doc, z):
+        self.cluster_doc_count[z] -= 1
+        self.cluster_word_count[z] -= len(doc)
+        for word in doc:
+            self.cluster_word_distribution[z][word] -= 1
+            if self.cluster_word_distribution[z][word] == 0:
+                del self.cluster_word_distribution[z][word]
+
+    def partial_fit(self, new_docs, n_iters=5, n_old_docs=None):
+        '''
+        Update a fitted model with new documents.
+        The new documents are added to the cluster counts, then n_iters Gibbs sweeps are run
+        over the new documents plus a random subset of the documents kept in doc_sample.
+        :param new_docs: list of list of str
+        :param n_iters: int
+            number of sweeps
+        :param n_old_docs: int
+            number of old documents resampled with the new ones, as many as the new ones if None
+        :return: list of length len(new_docs)
+            cluster label for each new document
+        '''
+        seen = self.number_docs or 0
+        rng = self._random_state(seen)
+        doc_sample = getattr(self, "doc_sample", [])
+
+        # grow the vocabulary and the number of documents
+        vocabulary = getattr(self, "vocabulary", None)
+        if vocabulary is not None:
+            new_words = vocabulary.update(new_docs)
+            new_docs = [vocabulary.filter(doc) for doc in new_docs]
+        else:
+            known_words = set().union(*[set(d) for d in self.cluster_word_distribution])
+            new_words = set(word for doc in new_docs for word in doc) - known_words
+        self.vocab_size = (self.vocab_size or 0) + len(new_words)
+        self.number_docs = seen + len(new_docs)
+
+        # old documents to resample, with their current cluster
+        n_old_docs = len(new_docs) if n_old_docs is None else n_old_docs
+        old_ix = rng.choice(len(doc_sample), size=min(n_old_docs, len(doc_sample)), replace=False) \
+            if len(doc_sample) > 0 else []
+        docs = list(new_docs) + [doc_sample[i][0] for i in old_ix]
+        d_z = [None for _ in new_docs] + [doc_sample[i][1] for i in old_ix]
+
+        # place the new documents according to the current model
+        for i, doc in enumerate(new_docs):
+            d_z[i] = self._sample(self.score(doc), rng)
+            self._add_doc(doc, d_z[i])
+
+        for _iter in range(n_iters):
+            for i, doc in enumerate(docs):
+                self._remove_doc(doc, d_z[i])
+                d_z[i] = self._sample(self.score(doc), rng)
+                self._add_doc(doc, d_z[i])
+
+        self.cluster_count = sum([1 for v in self.cluster_doc_count if v > 0])
+        for j, i in enumerate(old_ix):
+            doc_sample[i] = (doc_sample[i][0], d_z[len(new_docs) + j])
+        self.doc_sample = doc_sample
+        self._sample_docs(new_docs, d_z[:len(new_docs)], rng, seen)
+        self._update_top_words()
+        return d_z[:len(new_docs)]
+
+    def _update_top_words(self):
+        '''
+        Rebuild the index of the TOP_WORDS_SIZE most frequent words of each cluster
+        '''
+        self.top_words_index = [heapq.nlargest(TOP_WORDS_SIZE, distribution.items(), key=operator.itemgetter(1))
+                                for distribution in self.cluster_word_distribution]
+
+    def top_words(self, n):
+        '''
+        Most frequent words of each cluster
+        :param n: int
+        :return: list of length K of lists of (word, count), by decreasing count
+        '''
+        if n > TOP_WORDS_SIZE or not hasattr(self, "top_words_index"):
+            return [heapq.nlargest(n, distribution.items(), key=operator.itemgetter(1))
+                    for distribution in self.cluster_word_distribution]
+        return [top[:n] for top in self.top_words_index]
+
+    def _set_counts(self, m_z, n_z, n_z_w, id2word):
+        '''
+        Store count arrays as the list/dict attributes used by score and predict
+        :param m_z: array of length K with the number of documents per cluster
+        :param n_z: array of length K with the number of words per cluster
+        :param n_z_w: K x V array with the number of occurrences of each word per cluster
+        :param id2word: array of length V mapping word ids to words
+        '''
+        id2word = np.asarray(id2word, dtype=object)
+        self.cluster_doc_count = m_z.tolist()
+        self.cluster_word_count = n_z.tolist()
+        self.cluster_word_distribution = []
+        for counts in n_z_w:
+            nonzero = np.flatnonzero(counts)
+            self.cluster_word_distribution.append(dict(zip(id2word[nonzero].tolist(), counts[nonzero].tolist())))
+
     def score(self, doc):
         '''
         Score a document
@@ -209,8 +819,281 @@ class MovieGroupProcess:
     def choose_best_label(self, doc):
         '''
         Choose the highest probability label for the input document
-        :param doc: list[str]: The doc token stream
+        :param doc: list[str]: The doc token stream, the words pruned from the vocabulary are ignored
         :return:
         '''
+        vocabulary = getattr(self, "vocabulary", None)
+        if vocabulary is not None:
+            doc = vocabulary.filter(doc)
         p = self.score(doc)
-        return argmax(p), max(p)
\ No newline at end of file
+        return argmax(p), max(p)
+
+    def freeze(self):
+        '''
+        Compile the fitted model into a read-only form for fast batch inference
+        :return: FrozenMovieGroupProcess
+        '''
+        fit_vocabulary = getattr(self, "vocabulary", None)
+        if fit_vocabulary is not None:
+            vocabulary, word2id = fit_vocabulary.id2word, fit_vocabulary.word2id
+            doc_freqs, df_bounds = fit_vocabulary.doc_freqs, (fit_vocabulary.min_df, fit_vocabulary.max_df)
+        else:
+            vocabulary = sorted(set().union(*[set(d) for d in self.cluster_word_distribution]))
+            word2id = {word: ix for ix, word in enumerate(vocabulary)}
+            doc_freqs, df_bounds = None, None
+        n_z_w = np.zeros((self.K, len(vocabulary)), dtype=np.int64)
+        for label, distribution in enumerate(self.cluster_word_distribution):
+            for word, count in distribution.items():
+                n_z_w[label, word2id[word]] = count
+        # the sampled documents only contain words of the model, which partial_fit added to the counts
+        doc_sample = getattr(self, "doc_sample", [])
+        sample_words = np.array([word2id[word] for doc, _ in doc_sample for word in doc], dtype=np.int32)
+        sample_lengths = np.array([len(doc) for doc, _ in doc_sample], dtype=np.int64)
+        sample_labels = np.array([label for _, label in doc_sample], dtype=np.int64)
+        return FrozenMovieGroupProcess(self.K, self.alpha, self.beta, self.number_docs, self.vocab_size,
+                                       vocabulary, self.cluster_doc_count, self.cluster_word_count, n_z_w,
+                                       doc_freqs=doc_freqs, df_bounds=df_bounds,
+                                       doc_sample=(sample_words, sample_lengths, sample_labels))
+
+
+class FrozenMovieGroupProcess:
+    def __init__(self, K, alpha, beta, D, vocab_size, vocabulary, cluster_doc_count, cluster_word_count,
+                 cluster_word_matrix, log_word_prob=None, top_word_ids=None, top_word_counts=None, doc_freqs=None,
+                 df_bounds=None, doc_sample=None):
+        '''
+        Read-only compiled form of a fitted MovieGroupProcess.
+        All terms of formula (3) of Yin and Wang 2014 that do not depend on the document are precomputed:
+        a K x (V+1) table of log(n_z_w + beta), whose last column is used for out-of-vocabulary words,
+        and the prefix sums over the document length of the lD2 denominator of each cluster.
+        :param K: int
+        :param alpha: float
+        :param beta: float
+        :param D: number of documents the model was fitted on
+        :param vocab_size: vocabulary size used in the lD2 denominator
+        :param vocabulary: list of words, one per column of cluster_word_matrix
+        :param cluster_doc_count: list or array of length K
+        :param cluster_word_count: list or array of length K
+        :param cluster_word_matrix: K x len(vocabulary) array of word counts per cluster
+        :param log_word_prob: K x (len(vocabulary)+1) array, computed from cluster_word_matrix if None
+        :param top_word_ids: K x TOP_WORDS_SIZE array of the ids of the most frequent words of each cluster,
+                             padded with -1, computed from cluster_word_matrix if None
+        :param top_word_counts: K x TOP_WORDS_SIZE array of the counts of the words in top_word_ids
+        :param doc_freqs: document frequency of each word, if the model was fit with a Vocabulary
+        :param df_bounds: (min_df, max_df) of that Vocabulary
+        :param doc_sample: (word ids of the documents sampled for partial_fit, concatenated, length of each document,
+                           cluster of each document), no sample if None
+        '''
+        self.K = K
+        self.alpha = alpha
+        self.beta = beta
+        self.number_docs = D
+        self.vocab_size = vocab_size
+        self.vocabulary = np.asarray(vocabulary, dtype=str)
+        self._word2id = None
+        self.oov_id = len(self.vocabulary)
+        self.cluster_doc_count = np.asarray(cluster_doc_count, dtype=np.int64)
+        self.cluster_word_count = np.asarray(cluster_word_count, dtype=np.int64)
+        self.cluster_word_matrix = np.asarray(cluster_word_matrix)
+
+        if log_word_prob is None:
+            log_word_prob = np.empty((K, self.oov_id + 1), dtype=np.float64)
+            log_word_prob[:, :-1] = log(self.cluster_word_matrix + beta)
+            log_word_prob[:, -1] = log(beta)
+        self.log_word_prob = log_word_prob
+        if top_word_ids is None:
+            top_word_ids, top_word_counts = self._top_word_arrays()
+        self.top_word_ids = top_word_ids
+        self.top_word_counts = top_word_counts
+        self.doc_freqs = None if doc_freqs is None else np.asarray(doc_freqs, dtype=np.int64)
+        self.df_bounds = None if df_bounds is None else tuple(df_bounds)
+        if doc_sample is None:
+            doc_sample = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self.doc_sample_words, self.doc_sample_lengths, self.doc_sample_labels = doc_sample
+        self.log_cluster_prob = log(self.cluster_doc_count + alpha) - log(D - 1 + K * alpha)
+        self._lD2_prefix = np.zeros((K, 1), dtype=np.float64)
+        self._extend_lD2_prefix(64)
+
+    @property
+    def word2id(self):
+        if self._word2id is None:
+            self._word2id = {word: ix for ix, word in enumerate(self.vocabulary.tolist())}
+        return self._word2id
+
+    def _top_word_arrays(self):
+        '''
+        :return: (K x TOP_WORDS_SIZE ids of the most frequent words of each cluster, padded with -1,
+                  K x TOP_WORDS_SIZE counts of those words)
+        '''
+        size = min(TOP_WORDS_SIZE, self.cluster_word_matrix.shape[1])
+        ids = np.full((self.K, TOP_WORDS_SIZE), -1, dtype=np.int64)
+        counts = np.zeros((self.K, TOP_WORDS_SIZE), dtype=np.int64)
+        if size == 0:
+            return ids, counts
+        top = np.argpartition(-self.cluster_word_matrix, size - 1, axis=1)[:, :size]
+        top_counts = np.take_along_axis(self.cluster_word_matrix, top, axis=1)
+        order = np.lexsort((top, -top_counts), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_counts = np.take_along_axis(top_counts, order, axis=1)
+        ids[:, :size] = np.where(top_counts > 0, top, -1)
+        counts[:, :size] = top_counts
+        return ids, counts
+
+    def _extend_lD2_prefix(self, doc_size):
+        '''
+        Make sure the lD2 prefix sums cover documents of length doc_size.
+        _lD2_prefix[z, n] = sum(log(n_z[z] + V*beta + j - 1)) for j in 1..n
+        '''
+        current = self._lD2_prefix.shape[1] - 1
+        if doc_size <= current:
+            return
+        j = np.arange(current, doc_size)
+        terms = log(self.cluster_word_count[:, None] + self.vocab_size * self.beta + j)
+        extension = self._lD2_prefix[:, -1:] + np.cumsum(terms, axis=1)
+        self._lD2_prefix = np.concatenate([self._lD2_prefix, extension], axis=1)
+
+    def encode(self, doc):
+        '''
+        Map the tokens of a document to column ids of log_word_prob.
+        If the model was fit with a Vocabulary, the words it pruned are dropped, as they were from the
+        training documents; otherwise unknown words are mapped to the out-of-vocabulary column
+        :param doc: list[str]: The doc token stream
+        :return: int array
+        '''
+        word2id = self.word2id
+        if self.doc_freqs is not None:
+            return np.array([word2id[word] for word in doc if word in word2id], dtype=np.int64)
+        return np.fromiter((word2id.get(word, self.oov_id) for word in doc), dtype=np.int64, count=len(doc))
+
+    def log_scores(self, docs, batch_size=10000):
+        '''
+        Unnormalized log-probability of each document in each cluster
+        :param docs: list of list of str
+        :param batch_size: number of documents gathered at once, bounds memory to K x tokens per batch
+        :return: N x K array
+        '''
+        lp = np.empty((len(docs), self.K), dtype=np.float64)
+        for start in range(0, len(docs), batch_size):
+            encoded = [self.encode(doc) for doc in docs[start:start + batch_size]]
+            batch_lengths = np.array([len(ids) for ids in encoded], dtype=np.int64)
+            self._extend_lD2_prefix(int(batch_lengths.max()) if len(encoded) else 0)
+            lN2 = np.zeros((self.K, len(encoded)), dtype=np.float64)
+            nonempty = np.flatnonzero(batch_lengths)
+            if len(nonempty) > 0:
+                ids = np.concatenate([encoded[ix] for ix in nonempty])
+                offsets = np.concatenate([[0], np.cumsum(batch_lengths[nonempty])[:-1]])
+                lN2[:, nonempty] = np.add.reduceat(self.log_word_prob[:, ids], offsets, axis=1)
+            lp[start:start + len(encoded)] = \
+                (self.log_cluster_prob[:, None] + lN2 - self._lD2_prefix[:, batch_lengths]).T
+        return lp
+
+    def choose_best_labels(self, docs):
+        '''
+        Choose the highest probability label for each input document
+        :param docs: list of list of str
+        :return: (int array of labels, float array of probabilities of the chosen labels)
+        '''
+        lp = self.log_scores(docs)
+        if len(lp) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        labels = lp.argmax(axis=1)
+        lp_max = lp[np.arange(len(lp)), labels]
+        scores = 1. / exp(lp - lp_max[:, None]).sum(axis=1)
+        return labels, scores
+
+    def choose_best_label(self, doc):
+        '''
+        Choose the highest probability label for the input document
+        :param doc: list[str]: The doc token stream
+        :return:
+        '''
+        labels, scores = self.choose_best_labels([doc])
+        return labels[0], scores[0]
+
+    def top_words(self, n):
+        '''
+        Most frequent words of each cluster
+        :param n: int
+        :return: list of length K of lists of (word, count), by decreasing count
+        '''
+        topics = []
+        if n <= TOP_WORDS_SIZE:
+            for ids, counts in zip(self.top_word_ids, self.top_word_counts):
+                ids, counts = ids[:n], counts[:n]
+                keep = ids >= 0
+                topics.append(list(zip(self.vocabulary[ids[keep]].tolist(), counts[keep].tolist())))
+            return topics
+        for counts in self.cluster_word_matrix:
+            top = np.argsort(-counts, kind="stable")[:n]
+            top = top[counts[top] > 0]
+            topics.append(list(zip(self.vocabulary[top].tolist(), counts[top].tolist())))
+        return topics
+
+    def to_model(self):
+        '''
+        Reconstitute a trainable MovieGroupProcess
+        :return: MovieGroupProcess
+        '''
+        cluster_word_distribution = []
+        for counts in self.cluster_word_matrix:
+            nonzero = np.flatnonzero(counts)
+            cluster_word_distribution.append(dict(zip(self.vocabulary[nonzero].tolist(), counts[nonzero].tolist())))
+        model = MovieGroupProcess.from_data(self.K, self.alpha, self.beta, self.number_docs, self.vocab_size,
+                                            self.cluster_doc_count.tolist(), self.cluster_word_count.tolist(),
+                                            cluster_word_distribution)
+        if self.doc_freqs is not None:
+            min_df, max_df = self.df_bounds
+            model.vocabulary = Vocabulary(self.vocabulary.tolist(), self.doc_freqs.tolist(), int(min_df), max_df)
+        words = self.vocabulary[self.doc_sample_words].tolist()
+        ends = np.cumsum(self.doc_sample_lengths).tolist()
+        model.doc_sample = [(words[end - length:end], label) for end, length, label
+                            in zip(ends, self.doc_sample_lengths.tolist(), self.doc_sample_labels.tolist())]
+        return model
+
+    def save(self, path):
+        '''
+        Save the model as an uncompressed .npz file, which load can memory-map
+        :param path: str
+        '''
+        vocabulary_arrays = {}
+        if self.doc_freqs is not None:
+            vocabulary_arrays = {"doc_freqs": self.doc_freqs,
+                                 "df_bounds": np.array(self.df_bounds, dtype=np.float64)}
+        np.savez(path,
+                 format_version=np.array(MODEL_FORMAT_VERSION),
+                 hyperparameters=np.array([self.alpha, self.beta], dtype=np.float64),
+                 sizes=np.array([self.K, self.number_docs, self.vocab_size], dtype=np.int64),
+                 vocabulary=self.vocabulary,
+                 cluster_doc_count=self.cluster_doc_count,
+                 cluster_word_count=self.cluster_word_count,
+                 cluster_word_matrix=self.cluster_word_matrix.astype(np.int32),
+                 log_word_prob=self.log_word_prob,
+                 top_word_ids=self.top_word_ids,
+                 top_word_counts=self.top_word_counts,
+                 doc_sample_words=self.doc_sample_words,
+                 doc_sample_lengths=self.doc_sample_lengths,
+                 doc_sample_labels=self.doc_sample_labels,
+                 **vocabulary_arrays)
+
+    @staticmethod
+    def load(path, mmap=True):
+        '''
+        Load a model saved with save
+        :param path: str
+        :param mmap: bool
+            if True, the arrays are memory-mapped read-only instead of read into memory
+        :return: FrozenMovieGroupProcess
+        '''
+        arrays = _load_npz(path, mmap)
+        format_version = int(arrays["format_version"])
+        if format_version != MODEL_FORMAT_VERSION:
+            raise ValueError(f"{path} has model format version {format_version}, "
+                             f"this code reads version {MODEL_FORMAT_VERSION}")
+        alpha, beta = arrays["hyperparameters"].tolist()
+        K, D, vocab_size = arrays["sizes"].tolist()
+        return FrozenMovieGroupProcess(K, alpha, beta, D, vocab_size, arrays["vocabulary"],
+                                       arrays["cluster_doc_count"], arrays["cluster_word_count"],
+                                       arrays["cluster_word_matrix"], arrays["log_word_prob"],
+                                       arrays["top_word_ids"], arrays["top_word_counts"],
+                                       arrays.get("doc_freqs"), arrays.get("df_bounds"),
+                                       (arrays["doc_sample_words"], arrays["doc_sample_lengths"],
+                                        arrays["doc_sample_labels"]))
\ No newline at end of file
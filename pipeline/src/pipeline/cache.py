@@ -0,0 +1,93 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+# maximum number of keys per query, below the SQLite limit on the number of parameters
+QUERY_CHUNK_SIZE = 500
+
+
+class ResultCache:
+    def __init__(self, path, namespace, max_entries=None, max_age_days=None):
+        """
+        Persistent cache of model results (translations, sentiment scores, ...) in a SQLite file,
+        keyed by a hash of the model and of its input, so that only new inputs reach the model.
+        :param path: SQLite file, in memory if None
+        :param namespace: name of the table of the cache, e.g. "translation"
+        :param max_entries: number of entries kept by evict, least recently used first out, unlimited if None
+        :param max_age_days: entries not used for longer are removed by evict, never if None
+        """
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path if path is not None else ":memory:")
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {namespace} "
+                                 f"(key TEXT PRIMARY KEY, value TEXT, accessed REAL)")
+
+    @staticmethod
+    def key(*parts):
+        """content address of a result, e.g. key(model, source language, text)"""
+        return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """
+        :param keys: list of keys
+        :return: dict key -> cached value, for the keys in the cache
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = keys[start:start + QUERY_CHUNK_SIZE]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._connection.execute(f"SELECT key, value FROM {self.namespace} WHERE key IN ({placeholders})",
+                                            chunk).fetchall()
+            found.update((key, json.loads(value)) for key, value in rows)
+            self._connection.execute(f"UPDATE {self.namespace} SET accessed = ? WHERE key IN ({placeholders})",
+                                     [time.time()] + chunk)
+        self._connection.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        """
+        :param items: dict key -> json-serializable value
+        """
+        now = time.time()
+        self._connection.executemany(f"INSERT OR REPLACE INTO {self.namespace} (key, value, accessed) VALUES (?, ?, ?)",
+                                     [(key, json.dumps(value), now) for key, value in items.items()])
+        self._connection.commit()
+
+    def __len__(self):
+        return self._connection.execute(f"SELECT COUNT(*) FROM {self.namespace}").fetchone()[0]
+
+    def evict(self):
+        """
+        Remove the entries older than max_age_days, then the least recently used ones above max_entries
+        :return: number of removed entries
+        """
+        removed = 0
+        if self.max_age_days is not None:
+            cursor = self._connection.execute(f"DELETE FROM {self.namespace} WHERE accessed < ?",
+                                              (time.time() - self.max_age_days * 86400,))
+            removed += cursor.rowcount
+        if self.max_entries is not None:
+            cursor = self._connection.execute(f"DELETE FROM {self.namespace} WHERE key NOT IN "
+                                              f"(SELECT key FROM {self.namespace} ORDER BY accessed DESC LIMIT ?)",
+                                              (self.max_entries,))
+            removed += cursor.rowcount
+        self._connection.commit()
+        return removed
+
+    def log_stats(self):
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests * 100. if requests > 0 else 0.
+        logging.info(f"{self.namespace} cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                     f"{len(self)} entries")
+
+    def close(self):
+        self._connection.close()
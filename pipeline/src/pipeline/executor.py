@@ -0,0 +1,116 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, min_rate=None):
+        """
+        Rate limiter shared by the threads of a RequestExecutor: each request takes one token,
+        and tokens are added at rate per second up to capacity.
+        The rate is halved when the API throttles or fails, and recovers additively on success.
+        :param rate: maximum number of requests per second, from the API quota
+        :param capacity: maximum burst of requests, max(1, rate) if None
+        :param min_rate: lowest rate after slow_down, rate / 16 if None
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 16.
+        self.capacity = capacity if capacity is not None else max(1., rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """take one token, waiting for it if needed; return the number of seconds waited"""
+        waited = 0.
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2.)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.min_rate)
+
+
+class RequestExecutor:
+    def __init__(self, max_workers=8, requests_per_second=None, max_retries=5, backoff=1., max_backoff=60.,
+                 retry_on=()):
+        """
+        Keep up to max_workers requests to a remote API in flight, within its quota, and retry failed
+        requests with jittered exponential backoff
+        :param max_workers: number of threads sending requests
+        :param requests_per_second: rate of the token bucket limiting the requests, unlimited if None
+        :param max_retries: number of retries of a request before its error is raised
+        :param backoff: seconds of the first retry delay, doubled at each retry
+        :param max_backoff: maximum retry delay in seconds
+        :param retry_on: tuple of the exception types that are retried
+        """
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = tuple(retry_on)
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.elapsed = 0.
+        self._lock = threading.Lock()
+
+    def _call(self, function, item):
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None and self.bucket.acquire() > 0:
+                with self._lock:
+                    self.throttled += 1
+            try:
+                result = function(item)
+            except self.retry_on as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                if self.bucket is not None:
+                    self.bucket.slow_down()
+                # full jitter: uniform delay up to the exponential backoff
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                logging.warning(f"{type(e).__name__} in request, retrying in {delay:.1f}s")
+                time.sleep(delay)
+            else:
+                with self._lock:
+                    self.requests += 1
+                if self.bucket is not None:
+                    self.bucket.speed_up()
+                return result
+
+    def map(self, function, items):
+        """
+        Call function on each item concurrently
+        :return: list of the results, in the order of items
+        """
+        items = list(items)
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(tqdm(pool.map(lambda item: self._call(function, item), items), total=len(items)))
+        self.elapsed += time.time() - start
+        return results
+
+    def log_stats(self, name):
+        rate = self.requests / self.elapsed if self.elapsed > 0 else 0.
+        logging.info(f"{name}: {self.requests} requests in {self.elapsed:.1f}s ({rate:.1f} requests/s), "
+                     f"{self.retries} retries, {self.throttled} throttled")
@@ -0,0 +1,86 @@
+from collections import deque
+
+
+class GazetteerMatcher:
+    def __init__(self, names, geometries=None):
+        """
+        Find location names in texts with an Aho-Corasick automaton over the lowercased names, so that each
+        text is scanned once whatever the size of the gazetteer. Names only match whole words: the characters
+        around a match must not be letters or digits.
+        :param names: location names, in gazetteer order; when a text contains several names, the first in this
+                      order is returned. Duplicates and missing values are ignored
+        :param geometries: geometries of the names, in the same order; the first geometry of each name is kept
+        """
+        self.names = []
+        self.geometries = {}
+        priorities = {}
+        if geometries is None:
+            geometries = [None] * len(names)
+        for name, geometry in zip(names, geometries):
+            if not isinstance(name, str) or not name.strip():
+                continue
+            name = name.lower()
+            if name not in priorities:
+                priorities[name] = len(self.names)
+                self.names.append(name)
+                self.geometries[name] = geometry
+
+        # trie of the names, each node: dict char -> child, failure link, list of (priority, length) ending here
+        self._goto, self._fail, self._out = [{}], [0], [[]]
+        for priority, name in enumerate(self.names):
+            node = 0
+            for char in name:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][char] = child
+                node = child
+            self._out[node].append((priority, len(name)))
+
+        # failure links, breadth first so that the links of shallower nodes are set first
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def __len__(self):
+        return len(self.names)
+
+    def match(self, text):
+        """
+        :return: first name of the gazetteer found in text, None if none is found or text is not a str
+        """
+        if not isinstance(text, str):
+            return None
+        text = text.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        node, best = 0, None
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for priority, length in out[node]:
+                if best is not None and priority >= best:
+                    continue
+                start = end - length
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    best = priority
+            if best == 0:
+                break
+        return None if best is None else self.names[best]
+
+    def match_many(self, texts):
+        """
+        :param texts: iterable of texts (e.g. a pandas Series)
+        :return: list of the first name found in each text (see match)
+        """
+        return [self.match(text) for text in texts]
@@ -1,10 +1,6 @@
-import tweepy
-import facebook
 import pandas as pd
 import requests
 import os
-from google.oauth2 import service_account
-import googleapiclient.discovery
 from pipeline.utils import get_blob_service_client, get_secret_keyvault, save_data
 import logging
 
@@ -17,6 +13,7 @@ except ImportError:
 
 def get_twitter(config):
     logging.info('getting twitter data')
+    import tweepy
 
     # initialize twitter API
     twitter_secrets = get_secret_keyvault("twitter-secret", config)
@@ -130,6 +127,8 @@ def get_youtube(config):
     if len(channel_ids) == 0:
         raise ValueError("No youtube channel specified")
 
+    import googleapiclient.discovery
+    from google.oauth2 import service_account
     os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1" # Disable OAuthlib's HTTPS verification
     api_service_name = "youtube"
     api_version = "v3"
@@ -208,6 +207,7 @@ def get_kobo(config):
 
 
 def get_facebook(config):
+    import facebook
 
     # get data from facebook
     facebook_secrets = get_secret_keyvault('facebook-secret', config)
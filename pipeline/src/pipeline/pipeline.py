@@ -5,7 +5,6 @@ from pipeline.get_data import get_twitter, get_youtube, get_kobo, get_facebook
 from pipeline.parse_data import parse_twitter, parse_youtube, parse_kobo, parse_facebook, parse_azure_table,\
     merge_sources
 from pipeline.utils import get_table_service_client
-from azure.data.tables import UpdateMode
 from tqdm import tqdm
 import logging
 import click
@@ -52,6 +51,7 @@ def main(config, keep):
 
     # execute pipeline
     if config["track-azure-table"]:
+        from azure.data.tables import UpdateMode
         try:
             table_client = get_table_service_client(config["azure-table-name"], config)
             df = pd.DataFrame(table_client.query_entities("Timestamp gt datetime'2000-01-01T00:00:00Z'"))
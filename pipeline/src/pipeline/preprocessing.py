@@ -0,0 +1,213 @@
+import os
+import json
+import time
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+import gensim
+from gensim.parsing.preprocessing import STOPWORDS as GENSIM_STOPWORDS
+from nltk.stem import WordNetLemmatizer
+from nltk.stem.porter import PorterStemmer
+
+# stopwords added to gensim's, used when the configuration does not list any ("stopwords")
+DEFAULT_STOPWORDS = ['covid', 'vaccine', 'vaccines', 'vaccinated', 'namibia', 'says', 'because', 'like', 'get']
+
+
+class TokenNormalizer:
+    def __init__(self, stopwords=None, cache_size=100000, cache_path=None):
+        """
+        Tokenize texts and map each token to the stem of its verb lemma.
+        Surface tokens repeat across messages, so their stems are memoized in a bounded LRU cache
+        and, optionally, in a json file shared across runs.
+        :param stopwords: list of stopwords added to gensim's, DEFAULT_STOPWORDS if None
+        :param cache_size: maximum number of tokens in the LRU cache
+        :param cache_path: json file with the persistent token -> stem cache, none if None
+        """
+        if stopwords is None:
+            stopwords = DEFAULT_STOPWORDS
+        self.stopwords = frozenset(GENSIM_STOPWORDS) | frozenset(stopwords)
+        self.cache_size = cache_size
+        self.cache_path = cache_path
+        self.persistent_cache = {}
+        self.new_entries = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path) as cache_file:
+                self.persistent_cache = json.load(cache_file)
+        self._lemmatizer = WordNetLemmatizer()
+        self._stemmer = PorterStemmer()
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(stopwords=config.get("stopwords"), cache_path=config.get("normalizer-cache"))
+
+    def _normalize(self, token):
+        stem = self.persistent_cache.get(token)
+        if stem is None:
+            stem = self._stemmer.stem(self._lemmatizer.lemmatize(token, pos='v'))
+            if self.cache_path is not None:
+                self.persistent_cache[token] = stem
+                self.new_entries[token] = stem
+        return stem
+
+    def preprocess(self, text):
+        """
+        :return: (list of stems, dict mapping each stem to its surface token in the text)
+        """
+        result = []
+        token_list = []
+        for token in gensim.utils.simple_preprocess(text):
+            if len(token) > 2 and 'haha' not in token and token not in self.stopwords:
+                result.append(self.normalize(token))
+                token_list.append(token)
+        return result, dict(zip(result, token_list))
+
+    def save(self):
+        """write the persistent cache, if any"""
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        with open(self.cache_path, "w") as cache_file:
+            json.dump(self.persistent_cache, cache_file)
+
+
+# normalizer of each worker process of preprocess_texts
+_worker_normalizer = None
+
+
+def _init_preprocess_worker(stopwords, cache_size, cache_path, persistent_cache):
+    global _worker_normalizer
+    _worker_normalizer = TokenNormalizer(stopwords, cache_size)
+    _worker_normalizer.cache_path = cache_path
+    _worker_normalizer.persistent_cache = persistent_cache
+
+
+def _preprocess_chunk(texts):
+    results = [_worker_normalizer.preprocess(text) for text in texts]
+    new_entries, _worker_normalizer.new_entries = _worker_normalizer.new_entries, {}
+    return results, new_entries
+
+
+def preprocess_texts(texts, normalizer, n_workers=None, chunk_size=1000):
+    """
+    Preprocess texts in chunks on a process pool, results are identical to normalizer.preprocess
+    :param texts: iterable of str (e.g. a pandas Series)
+    :param normalizer: TokenNormalizer
+    :param n_workers: number of processes, all cores if None, serial if 1
+    :param chunk_size: number of texts per task
+    :return: (list of lists of stems, list of dicts stem -> surface token), in the order of texts
+    """
+    texts = list(texts)
+    n_workers = n_workers or os.cpu_count()
+    if n_workers == 1 or len(texts) <= chunk_size:
+        processed = [normalizer.preprocess(text) for text in texts]
+    else:
+        chunks = [texts[start:start + chunk_size] for start in range(0, len(texts), chunk_size)]
+        processed = []
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_preprocess_worker,
+                                 initargs=(normalizer.stopwords, normalizer.cache_size, normalizer.cache_path,
+                                           normalizer.persistent_cache)) as executor:
+            for results, new_entries in executor.map(_preprocess_chunk, chunks):
+                processed.extend(results)
+                normalizer.persistent_cache.update(new_entries)
+                normalizer.new_entries.update(new_entries)
+    return [item[0] for item in processed], [item[1] for item in processed]
+
+
+class SurfaceFormIndex:
+    def __init__(self, counts=None):
+        """
+        Number of documents in which each stem appears as each surface token, used to show
+        topic keywords as words rather than stems. The most frequent surface form of each stem
+        is kept up to date, so that lookups do not scan the corpus.
+        :param counts: dict stem -> dict surface token -> number of documents
+        """
+        self.counts = counts if counts is not None else {}
+        self._best = {stem: max(forms, key=forms.get) for stem, forms in self.counts.items()}
+
+    @staticmethod
+    def path_for(model_path):
+        """json file stored next to a topic model"""
+        return os.path.splitext(model_path)[0] + "-surface-forms.json"
+
+    def update(self, mapping_list):
+        """
+        :param mapping_list: list of dicts stem -> surface token, one per document (see TokenNormalizer.preprocess)
+        """
+        for mapping in mapping_list:
+            for stem, token in mapping.items():
+                forms = self.counts.setdefault(stem, {})
+                forms[token] = forms.get(token, 0) + 1
+                best = self._best.get(stem)
+                if best is None or forms[token] > forms[best]:
+                    self._best[stem] = token
+
+    def surface_form(self, stem):
+        """most frequent surface token of stem, stem itself if it was never seen"""
+        return self._best.get(stem, stem)
+
+    def save(self, path):
+        with open(path, "w") as index_file:
+            json.dump(self.counts, index_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as index_file:
+            return cls(json.load(index_file))
+
+
+class SpellCorrector:
+    def __init__(self, cache_path=None, distance=2, time_budget=None, skip_known=False):
+        """
+        Spell correction of topic keywords with pyspellchecker. Corrections are memoized by token
+        and, optionally, in a json file shared across runs, so that repeat runs only check new keywords.
+        :param cache_path: json file with the persistent token -> correction caches of each distance, none if None
+        :param distance: maximum edit distance of the candidates (1 or 2)
+        :param time_budget: seconds spent in pyspellchecker per run, unlimited if None.
+                            Once spent, tokens that are not cached are left unchanged
+        :param skip_known: if True, tokens of the spellchecker dictionary are left unchanged without
+                           generating candidates or filling the cache
+        """
+        self.cache_path = cache_path
+        self.distance = distance
+        self.time_budget = time_budget
+        self.skip_known = skip_known
+        self._caches = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path) as cache_file:
+                # corrections depend on the distance: one cache per distance, flat caches without it are dropped
+                self._caches = {key: cache for key, cache in json.load(cache_file).items() if isinstance(cache, dict)}
+        self.cache = self._caches.setdefault(str(distance), {})
+        self.time_spent = 0.
+        self._checker = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(cache_path=config.get("spell-cache"), distance=config.get("spell-distance", 2),
+                   time_budget=config.get("spell-time-budget"), skip_known=config.get("spell-skip-known", False))
+
+    def correct(self, token):
+        corrected = self.cache.get(token)
+        if corrected is not None:
+            return corrected
+        if self.time_budget is not None and self.time_spent >= self.time_budget:
+            return token
+        start = time.time()
+        if self._checker is None:
+            # loading the word frequency list is slow, only do it on the first cache miss
+            from spellchecker import SpellChecker
+            self._checker = SpellChecker(distance=self.distance)
+        if self.skip_known and self._checker.known([token]):
+            self.time_spent += time.time() - start
+            return token
+        corrected = self._checker.correction(token) or token
+        self.time_spent += time.time() - start
+        self.cache[token] = corrected
+        return corrected
+
+    def save(self):
+        """write the persistent cache, if any"""
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        with open(self.cache_path, "w") as cache_file:
+            json.dump(self._caches, cache_file)
@@ -1,54 +1,48 @@
-import preprocessor as tp
 import pandas as pd
 import numpy as np
 import os
-import operator
-import gensim
-from google.cloud import language_v1
-from google.cloud import translate_v2 as translate
-from google.oauth2 import service_account
-from time import sleep
+from functools import lru_cache
 from requests.exceptions import ReadTimeout, ConnectionError
-from shapely.geometry import Polygon, Point
-import geopandas as gpd
 import json
-import enchant
-import transformers
-from nltk.stem import WordNetLemmatizer
-from nltk.stem.porter import *
 np.random.seed(2018)
-import nltk
-nltk.download('wordnet')
 import pickle
-stemmer = PorterStemmer()
-from spellchecker import SpellChecker
-spell = SpellChecker()
-from gensim.parsing.preprocessing import STOPWORDS
-STOPWORDS = list(STOPWORDS) # TBI move to config
-STOPWORDS.append('covid')
-STOPWORDS.append('vaccine')
-STOPWORDS.append('vaccines')
-STOPWORDS.append('vaccinated')
-STOPWORDS.append('namibia')
-STOPWORDS.append('says')
-STOPWORDS.append('because')
-STOPWORDS.append('like')
-STOPWORDS.append('get')
-from pipeline.GSDMM import MovieGroupProcess
+from pipeline.GSDMM import MovieGroupProcess, FrozenMovieGroupProcess, Vocabulary
+from pipeline.cache import ResultCache
+from pipeline.executor import RequestExecutor
+from pipeline.gazetteer import GazetteerMatcher
 import ast
-from azure.storage.blob import BlobServiceClient
-from azure.data.tables import TableServiceClient
 from tqdm import tqdm
 tqdm.pandas()
-tp.set_options(tp.OPT.URL, tp.OPT.EMOJI, tp.OPT.MENTION)
-en_dict = enchant.Dict("en_US")
-nltk.download('punkt')
 import logging
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
+
+# Heavy dependencies (transformers, geopandas, gensim, google-cloud, the Azure SDK, ...) are imported
+# in the functions of the stage that uses them, so that importing this module stays fast.
+# NLTK data is not downloaded here: it is read from the paths in the NLTK_DATA environment variable,
+# provisioned in the Docker image.
+
+
+@lru_cache(maxsize=None)
+def _tweet_preprocessor():
+    import preprocessor as tp
+    tp.set_options(tp.OPT.URL, tp.OPT.EMOJI, tp.OPT.MENTION)
+    return tp
+
+
+@lru_cache(maxsize=None)
+def _english_dictionary():
+    import enchant
+    return enchant.Dict("en_US")
+
+
+@lru_cache(maxsize=None)
+def _default_normalizer():
+    from pipeline.preprocessing import TokenNormalizer
+    return TokenNormalizer()
 
 
 def get_secret_keyvault(secret_name, config):
+    from azure.identity import DefaultAzureCredential
+    from azure.keyvault.secrets import SecretClient
     kv_url = config["keyvault-url"]
     # Authenticate with Azure
     az_credential = DefaultAzureCredential()
@@ -58,29 +52,12 @@ def get_secret_keyvault(secret_name, config):
     return secret_value
 
 
-class BreakIt(Exception):
-    pass
-
-
 def preprocess(text):
-    result = []
-    token_list = []
-    for token in gensim.utils.simple_preprocess(text):
-        if len(token) > 2 and 'haha' not in token and token not in STOPWORDS:
-            result.append(stemmer.stem(WordNetLemmatizer().lemmatize(token, pos='v')))
-            token_list.append(token)
-    return result, dict(zip(result, token_list))
-
-
-def produce_mapping(mapping_list):
-    mapping_pairs = pd.concat([pd.DataFrame([(k, v) for k, v in d.items()]) for d in mapping_list])
-    mapping_pairs['count'] = 1
-    mapping121 = mapping_pairs.groupby(by=[0, 1]).count().reset_index().sort_values(by=[0, 'count'], ascending=False).groupby(by=0).head(1)
-    mapping12many = mapping_pairs.drop(columns=['count']).drop_duplicates()
-    return mapping121, mapping12many
+    return _default_normalizer().preprocess(text)
 
 
 def get_blob_service_client(blob_path, config):
+    from azure.storage.blob import BlobServiceClient
     blobstorage_secrets = get_secret_keyvault('blobstorage-secret', config)
     blobstorage_secrets = json.loads(blobstorage_secrets)
     blob_service_client = BlobServiceClient.from_connection_string(blobstorage_secrets['connection_string'])
@@ -88,30 +65,69 @@ def get_blob_service_client(blob_path, config):
     return blob_service_client.get_blob_client(container=container, blob=blob_path)
 
 
+def open_result_cache(namespace, config):
+    """
+    Open the result cache of a stage (e.g. "translation"), stored in "cache-directory" (in memory if not set)
+    and synced from "cache-blob-directory" in the datalake, if set
+    """
+    cache_path = None
+    if config.get("cache-directory"):
+        os.makedirs(config["cache-directory"], exist_ok=True)
+        cache_path = os.path.join(config["cache-directory"], f"{namespace}-cache.sqlite")
+        if config.get("cache-blob-directory") and not config.get("skip-datalake", False):
+            from azure.core.exceptions import ResourceNotFoundError
+            blob_client = get_blob_service_client(
+                os.path.join(config["cache-blob-directory"], os.path.basename(cache_path)), config)
+            try:
+                content = blob_client.download_blob().readall()
+                with open(cache_path, "wb") as download_file:
+                    download_file.write(content)
+            except ResourceNotFoundError:
+                logging.info(f"no {namespace} cache in the datalake, starting a new one")
+    return ResultCache(cache_path, namespace, max_entries=config.get("cache-max-entries"),
+                       max_age_days=config.get("cache-max-age-days"))
+
+
+def model_cache_id(model, config):
+    """model identifier in the result cache keys, quantized HuggingFace models have results of their own"""
+    if "HuggingFace" in model and config.get("quantize-models", False):
+        return model + "+int8"
+    return model
+
+
+def topic_model_cache_id(model_filename):
+    """model identifier in the keys of the topic model cache, the same for the pickle and the npz of a model"""
+    return os.path.splitext(os.path.basename(model_filename))[0]
+
+
+def close_result_cache(cache, config):
+    """evict old entries, log hits and misses, and upload the cache to the datalake if synced"""
+    removed = cache.evict()
+    if removed > 0:
+        logging.info(f"evicted {removed} entries from the {cache.namespace} cache")
+    cache.log_stats()
+    cache.close()
+    if cache.path is not None and config.get("cache-blob-directory") and not config.get("skip-datalake", False):
+        blob_client = get_blob_service_client(
+            os.path.join(config["cache-blob-directory"], os.path.basename(cache.path)), config)
+        with open(cache.path, "rb") as upload_file:
+            blob_client.upload_blob(upload_file, overwrite=True)
+
+
 def get_table_service_client(table, config):
+    from azure.data.tables import TableServiceClient
     table_secret = get_secret_keyvault('table-secret', config)
     table_service_client = TableServiceClient.from_connection_string(table_secret)
     return table_service_client.get_table_client(table_name=table)
 
 
-def match_location(x, gdf, target_column, loc_column, locations):
-    """ if "coord" is empty do string matching, else find coord """
-    sentence = x[target_column]
+def match_location(x, gdf, loc_column):
+    """ find the location containing "coord" (string matching is done by GazetteerMatcher) """
     coords = x['coord']
     if pd.isna(coords):
-        if not pd.isna(sentence):
-            loc_match = [loc for loc in locations if loc in sentence.lower()]
-            # now taking the first match; TBI resolve ambiguities
-            if len(loc_match) > 0:
-                gdf_match = gdf[gdf[loc_column] == loc_match[0]]
-                match_loc = gdf_match[loc_column].values[0]
-                match_geo = gdf_match['geometry'].values[0]
-                return match_geo, match_loc
-            else:
-                return np.nan, np.nan
-        else:
-            return np.nan, np.nan
+        return np.nan, np.nan
     else:
+        import geopandas as gpd
         gdf_x = gpd.GeoDataFrame(pd.DataFrame(x).transpose(), geometry='coord', crs="EPSG:4326")
         gdf_x = gdf_x.drop(columns=[loc_column])
         res_union = gpd.overlay(gdf_x, gdf, how='intersection')
@@ -126,6 +142,7 @@ def match_location(x, gdf, target_column, loc_column, locations):
 def extract_coordinates(x):
     """ extract coordinates from tweet's place field """
     if not pd.isna(x):
+        from shapely.geometry import Polygon, Point
         x = ast.literal_eval(x)
         bbox = Polygon(x['bounding_box']['coordinates'][0])
         centroid = bbox.centroid.coords
@@ -159,6 +176,7 @@ def geolocate_dataframe(df_tweets, location_file, adm0_file,
                         location_input, location_output,
                         target, config, tw_place_column=""):
     logging.info("geolocating")
+    import geopandas as gpd
 
     # download geodata if not present
     if not os.path.exists(location_file):
@@ -176,7 +194,7 @@ def geolocate_dataframe(df_tweets, location_file, adm0_file,
         if loc_col not in gdf.columns:
             logging.warning(f"{loc_col} not in location file {location_file}, check config")
             continue
-        gdf['is_english'] = gdf[loc_col].apply(en_dict.check)
+        gdf['is_english'] = gdf[loc_col].apply(_english_dictionary().check)
         gdf = gdf[~gdf['is_english']].drop(columns=['is_english'])
         gdf[loc_col] = gdf[loc_col].str.lower()
 
@@ -192,10 +210,20 @@ def geolocate_dataframe(df_tweets, location_file, adm0_file,
     for loc_col in location_input:
         if loc_col not in gdf.columns:
             continue
-        locations = [loc.lower() for loc in gdf[loc_col].values]
+        matcher = GazetteerMatcher(gdf[loc_col].values, gdf['geometry'].values)
         for target_col in target:
-            df_tweets['temp_coord'], df_tweets['temp_location'] = \
-                zip(*df_tweets.progress_apply(lambda x: match_location(x, gdf, target_col, loc_col, locations), axis=1))
+            coords, locations = [np.nan] * len(df_tweets), [np.nan] * len(df_tweets)
+            has_coord = df_tweets['coord'].notna().values
+            # messages without coordinates: first location of the gazetteer named in the text
+            # (now taking the first match; TBI resolve ambiguities)
+            matches = matcher.match_many(df_tweets[target_col].values[~has_coord])
+            for ix, loc_match in zip(np.flatnonzero(~has_coord), matches):
+                if loc_match is not None:
+                    coords[ix], locations[ix] = matcher.geometries[loc_match], loc_match
+            for ix in np.flatnonzero(has_coord):
+                coords[ix], locations[ix] = match_location(df_tweets.iloc[ix], gdf, loc_col)
+            df_tweets['temp_coord'] = pd.Series(coords, index=df_tweets.index, dtype=object)
+            df_tweets['temp_location'] = pd.Series(locations, index=df_tweets.index, dtype=object)
             df_tweets['coord'] = df_tweets['coord'].fillna(df_tweets['temp_coord'])
             df_tweets[location_output] = df_tweets[location_output].fillna(df_tweets['temp_location'])
 
@@ -219,7 +247,7 @@ def geolocate_dataframe(df_tweets, location_file, adm0_file,
 
 
 def clean_text(row_, text_column):
-    text_clean = tp.clean(row_[text_column]).lower().replace(': ', '')
+    text_clean = _tweet_preprocessor().clean(row_[text_column]).lower().replace(': ', '')
     return text_clean
 
 
@@ -241,35 +269,82 @@ def html_decode(row_, text_column):
     return text
 
 
-def translate_string(row_, translate_client, text_field, model):
-    text = row_[text_field]
-    if 'lang' in row_.keys():
-        lang = row_['lang']
-    else:
-        lang = 'unknown'
-    if lang != 'en':
-        trans = None
-        if model == "Google":
-            try:
-                response = translate_client.translate(text, target_language="en")
-            except ReadTimeout or ConnectionError:
-                sleep(60)
-                try:
-                    response = translate_client.translate(text, target_language="en")
-                except ReadTimeout or ConnectionError:
-                    sleep(60)
-                    response = translate_client.translate(text, target_language="en")
-            trans = response["translatedText"]
-        elif "HuggingFace" in model:
-            response = translate_client(text)[0]
-            trans = response["translation_text"]
-
-        if pd.isna(trans):
-            return text
-        else:
-            return trans
-    else:
-        return text
+def fan_out(df, df_unique, key_column, value_columns):
+    """
+    Copy value_columns of df_unique, deduplicated on key_column, to all the rows of df with the same key
+    (hash join, rows without a match get NaN)
+    """
+    joined = df_unique.set_index(key_column)[value_columns].reindex(df[key_column].values)
+    for column in value_columns:
+        df[column] = joined[column].values
+    return df
+
+
+def _length_sorted_batches(texts, batch_size, batch_chars):
+    """
+    Group the indices of texts, sorted by length so that HuggingFace batches need little padding,
+    into batches of at most batch_size texts and batch_chars characters (longer texts are alone in their batch)
+    """
+    batches, batch, chars = [], [], 0
+    for ix in sorted(range(len(texts)), key=lambda ix: len(texts[ix])):
+        if batch and (len(batch) == batch_size or chars + len(texts[ix]) > batch_chars):
+            batches.append(batch)
+            batch, chars = [], 0
+        batch.append(ix)
+        chars += len(texts[ix])
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def translate_batch(texts, translate_client, model):
+    """translate a list of texts to english, with one request (Google) or one padded batch (HuggingFace)"""
+    if model == "Google":
+        return [item["translatedText"] for item in translate_client.translate(texts, target_language="en")]
+    elif "HuggingFace" in model:
+        return [item["translation_text"] for item in translate_client(texts, batch_size=len(texts))]
+
+
+def google_transient_errors():
+    """errors of the Google Cloud clients that are retried: quota, overload, timeouts and dropped connections"""
+    from google.api_core.exceptions import ServiceUnavailable, TooManyRequests, DeadlineExceeded, InternalServerError
+    return ServiceUnavailable, TooManyRequests, DeadlineExceeded, InternalServerError, ReadTimeout, ConnectionError
+
+
+def get_translate_executor(model, config):
+    """concurrent, rate-limited and retried requests for Google, one batch at a time for local HuggingFace models"""
+    if model == 'Google':
+        return RequestExecutor(max_workers=config.get('translation-workers', 8),
+                               requests_per_second=config.get('translation-requests-per-second'),
+                               max_retries=config.get('translation-max-retries', 5),
+                               retry_on=google_transient_errors())
+    return RequestExecutor(max_workers=1)
+
+
+def translate_texts(texts, translate_client, model, batch_size, batch_chars, executor):
+    """translate texts to english in length-sorted batches, return the translations in the order of texts"""
+    translations = list(texts)
+    batches = _length_sorted_batches(texts, batch_size, batch_chars)
+    results = executor.map(lambda batch: translate_batch([texts[ix] for ix in batch], translate_client, model),
+                           batches)
+    for batch, batch_translations in zip(batches, results):
+        for ix, trans in zip(batch, batch_translations):
+            if not pd.isna(trans):
+                translations[ix] = trans
+    return translations
+
+
+def get_translate_client(model, config):
+    translate_client = None
+    if model == 'Google':
+        from google.cloud import translate_v2 as translate
+        from google.oauth2 import service_account
+        service_account_info = get_secret_keyvault('google-secret', config)
+        credentials = service_account.Credentials.from_service_account_info(json.loads(service_account_info))
+        translate_client = translate.Client(credentials=credentials)
+    elif 'HuggingFace' in model:
+        translate_client = load_huggingface_pipeline("translation", model, config)
+    return translate_client
 
 
 def translate_dataframe(df_tweets, text_column, text_column_en, config):
@@ -280,32 +355,42 @@ def translate_dataframe(df_tweets, text_column, text_column_en, config):
 
     logging.info(f'translating with {model}')
 
-    translate_client = None
-    if model == 'Google':
-        service_account_info = get_secret_keyvault('google-secret', config)
-        credentials = service_account.Credentials.from_service_account_info(json.loads(service_account_info))
-        translate_client = translate.Client(credentials=credentials)
-    elif 'HuggingFace' in model:
-        model_tag = model.replace("HuggingFace:", "")
-        translate_client = transformers.pipeline("translation", model=model_tag)
-
     df_tweets = df_tweets.dropna(subset=[text_column])
     df_texts = df_tweets.drop_duplicates(subset=[text_column])
 
-    # translate to english
-    df_texts[text_column] = df_texts.progress_apply(lambda x:
-                                                    translate_string(x, translate_client, text_column, model),
-                                                    axis=1)
-
-    for ix, row in df_tweets.iterrows():
-        try:
-            df_texts_ = df_texts[df_texts['id'] == row['id']]
-            if len(df_texts_) > 0:
-                df_tweets.at[ix, text_column_en] = df_texts_[text_column].values[0]
-        except:
-            df_tweets.at[ix, text_column_en] = np.nan
-
-    return df_tweets
+    # translate to english, in batches of texts that are not in english
+    if model == 'Google':
+        # the v2 API takes at most 128 texts per request and recommends at most 5k characters
+        batch_size, batch_chars = config.get('translation-batch-size', 100), config.get('translation-batch-chars', 5000)
+    else:
+        batch_size, batch_chars = config.get('translation-batch-size', 16), config.get('translation-batch-chars', np.inf)
+    if 'lang' in df_texts.columns:
+        to_translate = (df_texts['lang'] != 'en').values
+        langs = df_texts['lang'].values[to_translate].tolist()
+    else:
+        to_translate = np.ones(len(df_texts), dtype=bool)
+        langs = ['unknown'] * len(df_texts)
+    texts = df_texts[text_column].values[to_translate].tolist()
+    df_texts[text_column_en] = df_texts[text_column]
+
+    # only translate the texts that are not in the cache
+    cache = open_result_cache('translation', config)
+    keys = [ResultCache.key(model_cache_id(model, config), lang, text) for lang, text in zip(langs, texts)]
+    translations = cache.get_many(keys)
+    new_ix = [ix for ix, key in enumerate(keys) if key not in translations]
+    if len(new_ix) > 0:
+        translate_client = get_translate_client(model, config)
+        executor = get_translate_executor(model, config)
+        new_translations = translate_texts([texts[ix] for ix in new_ix], translate_client, model,
+                                           batch_size, batch_chars, executor)
+        executor.log_stats('translation')
+        new_translations = {keys[ix]: trans for ix, trans in zip(new_ix, new_translations)}
+        translations.update(new_translations)
+        cache.set_many(new_translations)
+    close_result_cache(cache, config)
+    df_texts.loc[to_translate, text_column_en] = [translations[key] for key in keys]
+
+    return fan_out(df_tweets, df_texts, text_column, [text_column_en])
 
 
 def filter_by_keywords(df_tweets, text_columns, keywords):
@@ -317,62 +402,159 @@ def filter_by_keywords(df_tweets, text_columns, keywords):
     return df_tweets
 
 
-def detect_sentiment(row, nlp_client, text_column, model="HuggingFace"):
-    text = row[text_column]
-    if pd.isna(text):
-        return np.nan, np.nan
-    else:
-        if model == "Google":
-            TYPE_ = language_v1.Document.Type.PLAIN_TEXT
-            ENCODING_ = language_v1.EncodingType.UTF8
-            document = {"content": text, "type_": TYPE_, "language": "en"}
-            response = nlp_client.analyze_sentiment(request={'document': document, 'encoding_type': ENCODING_})
-            return response.document_sentiment.score, response.document_sentiment.magnitude
-        elif "HuggingFace" in model:
-            response = nlp_client(text, return_all_scores=True)[0]
-            weights = []
-            if len(response) == 2:
-                weights = [-1, 1]
-            elif len(response) == 3:
-                weights = [-1, 0, 1]
-            score, maxscore = 0, 0
-            for ix, label in enumerate(response):
-                score += label['score'] * weights[ix]
-                if label['score'] > maxscore:
-                    maxscore = label['score']
-            return score, maxscore
+def analyze_sentiment_google(text, nlp_client):
+    """sentiment score and magnitude of an english text, with one Natural Language API request"""
+    from google.cloud import language_v1
+    TYPE_ = language_v1.Document.Type.PLAIN_TEXT
+    ENCODING_ = language_v1.EncodingType.UTF8
+    document = {"content": text, "type_": TYPE_, "language": "en"}
+    response = nlp_client.analyze_sentiment(request={'document': document, 'encoding_type': ENCODING_})
+    return response.document_sentiment.score, response.document_sentiment.magnitude
 
 
-def predict_sentiment(df_tweets, text_column, config):
+def get_sentiment_executor(config):
+    """concurrent, rate-limited and retried Natural Language API requests"""
+    requests_per_minute = config.get('sentiment-requests-per-minute')
+    return RequestExecutor(max_workers=config.get('sentiment-workers', 8),
+                           requests_per_second=requests_per_minute / 60. if requests_per_minute else None,
+                           max_retries=config.get('sentiment-max-retries', 5),
+                           retry_on=google_transient_errors())
 
-    model = 'HuggingFace' # default model
-    if 'sentiment-model' in config.keys():
-        model = config['sentiment-model']
 
-    logging.info(f'predicting sentiment with {model}')
+def detect_sentiment_google(texts, nlp_client, executor):
+    """
+    Google sentiment of texts, one request per text sent concurrently by executor (see get_sentiment_executor)
+    :return: list of (score, magnitude), in the order of texts
+    """
+    return executor.map(lambda text: analyze_sentiment_google(text, nlp_client), texts)
+
+
+def sentiment_from_labels(response):
+    """sentiment score (weighted sum of the label scores) and maximum label score of a HuggingFace response"""
+    weights = []
+    if len(response) == 2:
+        weights = [-1, 1]
+    elif len(response) == 3:
+        weights = [-1, 0, 1]
+    score, maxscore = 0, 0
+    for ix, label in enumerate(response):
+        score += label['score'] * weights[ix]
+        if label['score'] > maxscore:
+            maxscore = label['score']
+    return score, maxscore
+
+
+def _model_max_length(nlp_client):
+    max_length = nlp_client.tokenizer.model_max_length
+    if max_length > 100000:
+        # not set in the tokenizer configuration
+        max_length = getattr(nlp_client.model.config, "max_position_embeddings", 512)
+        # RoBERTa-style position ids start after the padding index (e.g. 514 embeddings for 512 tokens)
+        padding_idx = getattr(getattr(nlp_client.model.base_model, "embeddings", None), "padding_idx", None)
+        if padding_idx is not None:
+            max_length -= padding_idx + 1
+    return max_length
+
+
+def detect_sentiment_batch(texts, nlp_client, batch_size=32):
+    """
+    HuggingFace sentiment of texts, in batches of texts of similar token length to limit padding.
+    Texts longer than the model maximum length are truncated.
+    :return: list of (score, maximum label score), in the order of texts
+    """
+    if len(texts) == 0:
+        return []
+    max_length = _model_max_length(nlp_client)
+    lengths = [len(ids) for ids in nlp_client.tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]]
+    order = np.argsort(lengths, kind="stable")
+    results = [None] * len(texts)
+    for start in tqdm(range(0, len(texts), batch_size)):
+        batch = order[start:start + batch_size]
+        responses = nlp_client([texts[ix] for ix in batch], return_all_scores=True, batch_size=len(batch),
+                               truncation=True, max_length=max_length)
+        for ix, response in zip(batch, responses):
+            results[ix] = sentiment_from_labels(response)
+    return results
+
+
+def load_huggingface_pipeline(task, model, config):
+    """
+    transformers pipeline of a "HuggingFace:<model tag>" model for CPU inference. If "quantize-models" is set,
+    the linear layers are quantized to int8 with dynamic activation quantization, which is faster on CPU
+    at a small cost in accuracy (see benchmarks/benchmark_quantization.py)
+    """
+    import transformers
+    set_torch_threads(config)
+    nlp_pipeline = transformers.pipeline(task, model=model.replace("HuggingFace:", ""))
+    if config.get("quantize-models", False):
+        import torch
+        nlp_pipeline.model = torch.quantization.quantize_dynamic(nlp_pipeline.model, {torch.nn.Linear},
+                                                                 dtype=torch.qint8)
+    return nlp_pipeline
+
+
+def set_torch_threads(config):
+    """set the intra-op ("torch-threads") and inter-op ("torch-interop-threads") threads of CPU inference"""
+    import torch
+    torch.set_num_threads(config.get("torch-threads", os.cpu_count()))
+    interop_threads = config.get("torch-interop-threads", 1)
+    if torch.get_num_interop_threads() == interop_threads:
+        return
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # can only be set once per process, before any inter-op parallel work
+        logging.warning(f"inter-op threads already set to {torch.get_num_interop_threads()}")
 
+
+def get_sentiment_client(model, config):
     nlp_client = None
     if model == 'Google':
+        from google.cloud import language_v1
+        from google.oauth2 import service_account
         service_account_info = get_secret_keyvault('google-secret', config)
         credentials = service_account.Credentials.from_service_account_info(json.loads(service_account_info))
         nlp_client = language_v1.LanguageServiceClient(credentials=credentials)
     elif 'HuggingFace' in model:
-        model_tag = model.replace("HuggingFace:", "")
-        nlp_client = transformers.pipeline('sentiment-analysis', model=model_tag)
+        nlp_client = load_huggingface_pipeline('sentiment-analysis', model, config)
+    return nlp_client
 
-    df_texts = df_tweets.drop_duplicates(subset=[text_column])
 
-    # detect sentiment
-    df_texts['sentiment_score'], df_texts['sentiment_magnitude'] = \
-        zip(*df_texts.progress_apply(lambda x: detect_sentiment(x, nlp_client, text_column, model), axis=1))
+def predict_sentiment(df_tweets, text_column, config):
 
-    for ix, row in df_tweets.iterrows():
-        df_texts_ = df_texts[df_texts['id'] == row['id']]
-        if len(df_texts_) > 0:
-            df_tweets.at[ix, 'sentiment_score'] = df_texts_['sentiment_score'].values[0]
-            df_tweets.at[ix, 'sentiment_magnitude'] = df_texts_['sentiment_magnitude'].values[0]
+    model = 'HuggingFace' # default model
+    if 'sentiment-model' in config.keys():
+        model = config['sentiment-model']
 
-    return df_tweets
+    logging.info(f'predicting sentiment with {model}')
+
+    df_texts = df_tweets.drop_duplicates(subset=[text_column])
+    is_text = df_texts[text_column].notna().values
+    texts = df_texts[text_column].values[is_text].tolist()
+
+    # only detect the sentiment of the texts that are not in the cache
+    cache = open_result_cache('sentiment', config)
+    keys = [ResultCache.key(model_cache_id(model, config), text) for text in texts]
+    sentiments = cache.get_many(keys)
+    new_ix = [ix for ix, key in enumerate(keys) if key not in sentiments]
+    if len(new_ix) > 0:
+        nlp_client = get_sentiment_client(model, config)
+        new_texts = [texts[ix] for ix in new_ix]
+        if model == 'Google':
+            executor = get_sentiment_executor(config)
+            new_scores = detect_sentiment_google(new_texts, nlp_client, executor)
+            executor.log_stats('sentiment')
+        else:
+            new_scores = detect_sentiment_batch(new_texts, nlp_client, config.get('sentiment-batch-size', 32))
+        new_sentiments = {keys[ix]: list(score) for ix, score in zip(new_ix, new_scores)}
+        sentiments.update(new_sentiments)
+        cache.set_many(new_sentiments)
+    close_result_cache(cache, config)
+    scores = [sentiments[key] for key in keys]
+    df_texts['sentiment_score'], df_texts['sentiment_magnitude'] = np.nan, np.nan
+    df_texts.loc[is_text, ['sentiment_score', 'sentiment_magnitude']] = np.array(scores, dtype=float).reshape(-1, 2)
+
+    return fan_out(df_tweets, df_texts, text_column, ['sentiment_score', 'sentiment_magnitude'])
 
 
 class CustomUnpickler(pickle.Unpickler):
@@ -383,6 +565,38 @@ class CustomUnpickler(pickle.Unpickler):
             return super().find_class(module, name)
 
 
+def save_topic_model(model, model_filepath, blob_path, config, surface_forms=None):
+    """save topic model locally (npz or pickle, based on extension) and upload it for later use,
+    together with its surface form index if given"""
+    from pipeline.preprocessing import SurfaceFormIndex
+    if model_filepath.endswith('.npz'):
+        model.freeze().save(model_filepath)
+    else:
+        pickle.dump(model, open(model_filepath, "wb"))
+    uploads = [(model_filepath, blob_path)]
+    if surface_forms is not None:
+        surface_forms.save(SurfaceFormIndex.path_for(model_filepath))
+        uploads.append((SurfaceFormIndex.path_for(model_filepath), SurfaceFormIndex.path_for(blob_path)))
+    for local_path, remote_path in uploads:
+        blob_client = get_blob_service_client(remote_path, config)
+        with open(local_path, "rb") as data:
+            blob_client.upload_blob(data, overwrite=True)
+
+
+def load_surface_forms(model_filepath, blob_path, config):
+    """download the surface form index of a topic model, None if the model has none"""
+    from azure.core.exceptions import ResourceNotFoundError
+    from pipeline.preprocessing import SurfaceFormIndex
+    blob_client = get_blob_service_client(SurfaceFormIndex.path_for(blob_path), config)
+    try:
+        content = blob_client.download_blob().readall()
+    except ResourceNotFoundError:
+        return None
+    with open(SurfaceFormIndex.path_for(model_filepath), "wb") as download_file:
+        download_file.write(content)
+    return SurfaceFormIndex.load(SurfaceFormIndex.path_for(model_filepath))
+
+
 def keywords_to_topic(df, df_topics):
     """assign a description ('theme') to each topic based on keywords"""
     for ix, row in df.iterrows():
@@ -394,6 +608,7 @@ def keywords_to_topic(df, df_topics):
 def predict_topic(df_tweets, text_column, config):
 
     logging.info('predicting topic')
+    from pipeline.preprocessing import TokenNormalizer, SurfaceFormIndex, SpellCorrector, preprocess_texts
     model_filename = config["model-filename"]
     keys_to_topic_filename = config["keys-to-topics-filename"]
     refit = False # True/ False
@@ -410,10 +625,11 @@ def predict_topic(df_tweets, text_column, config):
     text = text.drop_duplicates()
     len_original = len(text)
 
-    processed_ser = text.map(preprocess)
-    processed_docs = [item[0] for item in processed_ser]
-    mapping_list = [item[1] for item in processed_ser]
-    mapping121, mapping12many = produce_mapping(mapping_list)
+    topic_normalizer = TokenNormalizer.from_config(config)
+    processed_docs, mapping_list = preprocess_texts(text, topic_normalizer,
+                                                    n_workers=config.get("preprocess-workers"),
+                                                    chunk_size=config.get("preprocess-chunk-size", 1000))
+    topic_normalizer.save()
 
     # initialize and fit GSDMM model
     if not refit:
@@ -426,42 +642,71 @@ def predict_topic(df_tweets, text_column, config):
 
         if os.path.exists(model_filepath):
             logging.info('loading existing topic model')
-            model = CustomUnpickler(open(model_filepath, "rb")).load()
+            if model_filepath.endswith('.npz'):
+                model = FrozenMovieGroupProcess.load(model_filepath)
+            else:
+                model = CustomUnpickler(open(model_filepath, "rb")).load()
         else:
             logging.error("Error: no topic model found")
+        surface_forms = load_surface_forms(model_filepath, os.path.join(models_blob_path, model_filename), config)
+
+        update = config.get("update-topic-model", False)
+        if update and not config.get("cache-directory"):
+            logging.warning('the messages ingested by the topic model are remembered in the topic model cache, '
+                            'not updating the topic model without "cache-directory"')
+        elif update:
+            # add the messages the model has not ingested yet (re-fetched messages are skipped)
+            cache = open_result_cache('topic_model', config)
+            keys = [ResultCache.key(topic_model_cache_id(model_filename), t) for t in text]
+            ingested = cache.get_many(keys)
+            is_new = [key not in ingested for key in keys]
+            new_docs = [doc for doc, new in zip(processed_docs, is_new) if new]
+            logging.info(f'updating topic model with {len(new_docs)} new messages')
+            if len(new_docs) > 0:
+                if isinstance(model, FrozenMovieGroupProcess):
+                    model = model.to_model()
+                labels = model.partial_fit(new_docs, n_iters=config.get("update-topic-model-iterations", 5))
+                cache.set_many(dict(zip([key for key, new in zip(keys, is_new) if new], labels)))
+                if surface_forms is not None:
+                    surface_forms.update([mapping for mapping, new in zip(mapping_list, is_new) if new])
+                else:
+                    surface_forms = SurfaceFormIndex()
+                    surface_forms.update(mapping_list)
+                save_topic_model(model, model_filepath, os.path.join(models_blob_path, model_filename), config,
+                                 surface_forms)
+            close_result_cache(cache, config)
+        if surface_forms is None:
+            logging.info('no surface form index found for the topic model, building it from the current messages')
+            surface_forms = SurfaceFormIndex()
+            surface_forms.update(mapping_list)
     else:
         logging.info('initialize and fit topic model')
         model = MovieGroupProcess(K=6, alpha=0.3, beta=0.05, n_iters=500)
-        y = model.fit(processed_docs, len(processed_docs))
-        pickle.dump(model, open(model_filepath, "wb"))
-        # upload topic model for later use
-        blob_client = get_blob_service_client(os.path.join(models_blob_path, model_filename), config)
-        with open(model_filepath, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
+        vocabulary = Vocabulary.from_docs(processed_docs, min_df=config.get("topic-min-df", 2),
+                                          max_df=config.get("topic-max-df", 1.0))
+        y = model.fit(processed_docs, engine="numpy", vocabulary=vocabulary)
+        cache = open_result_cache('topic_model', config)
+        cache.set_many({ResultCache.key(topic_model_cache_id(model_filename), t): label for t, label in zip(text, y)})
+        close_result_cache(cache, config)
+        surface_forms = SurfaceFormIndex()
+        surface_forms.update(mapping_list)
+        save_topic_model(model, model_filepath, os.path.join(models_blob_path, model_filename), config,
+                         surface_forms)
 
 
     # create list of topic descriptions (lists of keywords) and scores
-    matched_topic_score_list = [model.choose_best_label(i) for i in processed_docs]
-    matched_topic_list = [t[0] for t in matched_topic_score_list]
-    score_list = [t[1] for t in matched_topic_score_list]
+    if not isinstance(model, FrozenMovieGroupProcess):
+        model = model.freeze()
+    matched_topic_list, score_list = model.choose_best_labels(processed_docs)
     text = pd.DataFrame({'text': text.values, 'topic_num': matched_topic_list, 'score': score_list})
 
     # create list of human-readable topic descriptions (de-lemmatize)
     logging.info('create list of human-readable topics (de-lemmatize)')
-    topic_list = [list(reversed(sorted(x.items(), key=operator.itemgetter(1))[-5:])) for x in model.cluster_word_distribution]
-    topic_list_flat = [[l[0] for l in x] for x in topic_list]
-    topic_list_human_readable = topic_list_flat.copy()
-    for ixt, topic in enumerate(topic_list_human_readable):
-        for ixw, word in enumerate(topic):
-            try:
-                for raw in text.text.values:
-                    for token in gensim.utils.simple_preprocess(raw):
-                        if word in token:
-                            topic_list_human_readable[ixt][ixw] = token
-                            raise BreakIt
-            except BreakIt:
-                pass
-    topic_list_human_readable = [[spell.correction(t) for t in l] for l in topic_list_human_readable]
+    topic_list_human_readable = [[surface_forms.surface_form(word) for word, _ in topic]
+                                 for topic in model.top_words(5)]
+    spell = SpellCorrector.from_config(config)
+    topic_list_human_readable = [[spell.correct(t) for t in l] for l in topic_list_human_readable]
+    spell.save()
 
     # create dataframe with best example per topic and topic description
     logging.info('create dataframe with best example per topic and topic description')
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from pipeline.utils import fan_out
+
+COLUMNS = ["sentiment_score", "sentiment_magnitude"]
+
+
+def legacy_fan_out(df, df_unique, value_columns):
+    """row by row join on id, as translate_dataframe and predict_sentiment did before fan_out"""
+    for ix, row in df.iterrows():
+        df_unique_ = df_unique[df_unique['id'] == row['id']]
+        if len(df_unique_) > 0:
+            for column in value_columns:
+                df.at[ix, column] = df_unique_[column].values[0]
+    return df
+
+
+def messages():
+    return pd.DataFrame({"id": [10, 11, 12, 13, 14, 15],
+                         "text": ["a", "b", "a", None, "c", "b"]}, index=[5, 3, 8, 0, 1, 2])
+
+
+def scores(df_unique):
+    """per-text results as predict_sentiment computes them, NaN for missing texts"""
+    df_unique = df_unique.copy()
+    df_unique["sentiment_score"] = df_unique["text"].map({"a": 0.5, "b": -0.25, "c": 0.})
+    df_unique["sentiment_magnitude"] = df_unique["text"].map({"a": 0.9, "b": 0.3, "c": 0.1})
+    return df_unique
+
+
+def test_fan_out_matches_legacy_join():
+    df = messages()
+    df_unique = scores(df.drop_duplicates(subset=["text"]))
+    new = fan_out(df.copy(), df_unique, "text", COLUMNS)
+    legacy = legacy_fan_out(df.copy(), df_unique, COLUMNS)
+    matched = legacy[COLUMNS[0]].notna()
+    pd.testing.assert_frame_equal(new[matched], legacy[matched])
+
+
+def test_fan_out_duplicate_texts_and_nan_keys():
+    df = messages()
+    df_unique = scores(df.drop_duplicates(subset=["text"]))
+    new = fan_out(df.copy(), df_unique, "text", COLUMNS)
+    # duplicate texts get the result of their text, which the legacy join on id left empty
+    np.testing.assert_array_equal(new["sentiment_score"].values, [0.5, -0.25, 0.5, np.nan, 0., -0.25])
+    np.testing.assert_array_equal(new["sentiment_magnitude"].values, [0.9, 0.3, 0.9, np.nan, 0.1, 0.3])
+    # the order and the index of the messages are kept
+    pd.testing.assert_frame_equal(new[["id", "text"]], df)
+
+
+def test_fan_out_unmatched_keys():
+    df = messages()
+    df_unique = scores(df[df["text"] == "a"].drop_duplicates(subset=["text"]))
+    new = fan_out(df.copy(), df_unique, "text", COLUMNS)
+    assert new["sentiment_score"].notna().tolist() == [True, False, True, False, False, False]
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from pipeline.GSDMM import MovieGroupProcess, FrozenMovieGroupProcess, Vocabulary
+
+
+def corpus(n_docs=300, n_topics=4, words_per_topic=30, doc_size=6, seed=0):
+    """short documents drawn from disjoint word lists"""
+    rng = np.random.RandomState(seed)
+    return [[f"t{topic}w{w}" for w in rng.randint(words_per_topic, size=doc_size)]
+            for topic in rng.randint(n_topics, size=n_docs)]
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy", "parallel"])
+def test_fit_counts_are_consistent(engine):
+    docs = corpus()
+    model = MovieGroupProcess(K=8, alpha=0.1, beta=0.1, n_iters=5, random_state=1)
+    labels = model.fit(docs, engine=engine)
+    assert len(labels) == len(docs)
+    assert model.cluster_doc_count == np.bincount(labels, minlength=8).tolist()
+    for label in range(8):
+        words = [word for doc, z in zip(docs, labels) if z == label for word in doc]
+        assert model.cluster_word_count[label] == len(words)
+        assert model.cluster_word_distribution[label] == {word: words.count(word) for word in set(words)}
+    assert np.isclose(sum(model.score(docs[0])), 1.)
+
+
+@pytest.mark.parametrize("min_df", [None, 2])
+def test_frozen_labels_match_choose_best_label(min_df, tmp_path):
+    docs = corpus()
+    model = MovieGroupProcess(K=8, alpha=0.1, beta=0.1, n_iters=5, random_state=1)
+    vocabulary = Vocabulary.from_docs(docs[:50], min_df=min_df) if min_df else None
+    model.fit(docs, engine="numpy", vocabulary=vocabulary)
+    # unknown words, a pruned or unseen word and an empty document
+    test_docs = docs[:50] + [["t0w1", "unseen"], ["unseen"], []]
+    expected = [model.choose_best_label(doc) for doc in test_docs]
+
+    frozen = model.freeze()
+    frozen.save(str(tmp_path / "model.npz"))
+    for scorer in (frozen, FrozenMovieGroupProcess.load(str(tmp_path / "model.npz"))):
+        labels, scores = scorer.choose_best_labels(test_docs)
+        assert labels.tolist() == [label for label, _ in expected]
+        np.testing.assert_allclose(scores, [score for _, score in expected], rtol=1e-9)
+        # ties between words of equal count can be ordered differently
+        assert [[count for _, count in topic] for topic in scorer.top_words(3)] == \
+            [[count for _, count in topic] for topic in model.top_words(3)]
+
+
+@pytest.mark.parametrize("min_df", [None, 2])
+def test_npz_model_updates_like_the_fitted_model(min_df, tmp_path):
+    docs = corpus()
+    model = MovieGroupProcess(K=8, alpha=0.1, beta=0.1, n_iters=5, random_state=1)
+    vocabulary = Vocabulary.from_docs(docs, min_df=min_df) if min_df else None
+    model.fit(docs, engine="numpy", vocabulary=vocabulary)
+    model.freeze().save(str(tmp_path / "model.npz"))
+    restored = FrozenMovieGroupProcess.load(str(tmp_path / "model.npz")).to_model()
+    assert restored.doc_sample == model.doc_sample
+    restored.random_state = model.random_state
+
+    new_docs = corpus(n_docs=40, seed=1) + [["t0w1", "unseen", "unseen"]]
+    for update in range(2):
+        labels = model.partial_fit(new_docs, n_iters=2)
+        assert restored.partial_fit(new_docs, n_iters=2) == labels
+        assert restored.cluster_doc_count == model.cluster_doc_count
+        assert restored.cluster_word_distribution == model.cluster_word_distribution
+        assert restored.doc_sample == model.doc_sample
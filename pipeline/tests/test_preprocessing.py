@@ -0,0 +1,39 @@
+import nltk
+import pytest
+from pipeline.preprocessing import TokenNormalizer, SpellCorrector, preprocess_texts
+
+TEXTS = ["The vaccines were arriving at the clinics today", "People are waiting, hahaha, since the morning",
+         "Nurses vaccinated thousands of children", "", "Rumours about the vaccine are spreading quickly",
+         "Clinics closed because of the rains"] * 5
+
+
+def wordnet_available():
+    try:
+        nltk.data.find("corpora/wordnet")
+        return True
+    except LookupError:
+        return False
+
+
+@pytest.mark.skipif(not wordnet_available(), reason="NLTK wordnet data not installed (see NLTK_DATA in the Dockerfile)")
+def test_parallel_preprocessing_matches_serial(tmp_path):
+    serial = preprocess_texts(TEXTS, TokenNormalizer(), n_workers=1)
+    assert serial == tuple(map(list, zip(*[TokenNormalizer().preprocess(text) for text in TEXTS])))
+
+    normalizer = TokenNormalizer(cache_path=str(tmp_path / "cache.json"))
+    parallel = preprocess_texts(TEXTS, normalizer, n_workers=2, chunk_size=4)
+    assert parallel == serial
+    # stems learned by the workers are merged back into the persistent cache
+    for mapping in parallel[1]:
+        for stem, token in mapping.items():
+            assert normalizer.persistent_cache[token] == stem
+            assert normalizer.new_entries[token] == stem
+
+
+@pytest.mark.parametrize("skip_known", [False, True])
+def test_spell_correction_skips_dictionary_words(skip_known):
+    pytest.importorskip("spellchecker")
+    spell = SpellCorrector(distance=1, skip_known=skip_known)
+    assert [spell.correct(token) for token in ["vaccine", "vacine", "people"]] == ["vaccine", "vaccine", "people"]
+    assert spell.cache == ({"vacine": "vaccine"} if skip_known else
+                           {"vaccine": "vaccine", "vacine": "vaccine", "people": "people"})
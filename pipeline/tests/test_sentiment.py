@@ -0,0 +1,47 @@
+import string
+import numpy as np
+import pytest
+from pipeline.utils import load_huggingface_pipeline, detect_sentiment_batch, sentiment_from_labels, _model_max_length
+
+transformers = pytest.importorskip("transformers")
+torch = pytest.importorskip("torch")
+
+WORDS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + list(string.ascii_lowercase) + \
+        ["##" + char for char in string.ascii_lowercase] + ["the", "vaccine", "is", "good", "bad", "not", "people"]
+TEXTS = ["the vaccine is good", "bad", "not good people", "the vaccine is not bad at all",
+         "good " * 100, "vaccine", "people is people"]
+
+
+def tiny_model(path, model_max_length=None):
+    """random 3-label BERT, or RoBERTa (padding-offset position ids) if the tokenizer has no maximum length"""
+    (path / "vocab.txt").write_text("\n".join(WORDS))
+    kwargs = {} if model_max_length is None else {"model_max_length": model_max_length}
+    tokenizer = transformers.BertTokenizerFast(str(path / "vocab.txt"), **kwargs)
+    config = dict(vocab_size=len(WORDS), hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                  intermediate_size=32, num_labels=3, pad_token_id=0,
+                  id2label={0: "negative", 1: "neutral", 2: "positive"},
+                  label2id={"negative": 0, "neutral": 1, "positive": 2})
+    torch.manual_seed(0)
+    if model_max_length is None:
+        model = transformers.RobertaForSequenceClassification(
+            transformers.RobertaConfig(max_position_embeddings=34, **config))
+    else:
+        model = transformers.BertForSequenceClassification(
+            transformers.BertConfig(max_position_embeddings=model_max_length, **config))
+    model.eval()
+    model.save_pretrained(str(path))
+    tokenizer.save_pretrained(str(path))
+    return f"HuggingFace:{path}"
+
+
+@pytest.mark.parametrize("model_max_length", [32, None])
+def test_batches_match_per_text_sentiment(tmp_path, model_max_length):
+    nlp_client = load_huggingface_pipeline('sentiment-analysis', tiny_model(tmp_path, model_max_length), {})
+    max_length = _model_max_length(nlp_client)
+    # RoBERTa position ids start after the padding index (0 here): 34 embeddings for 33 tokens
+    assert max_length == (33 if model_max_length is None else model_max_length)
+    expected = [sentiment_from_labels(nlp_client(text, return_all_scores=True, truncation=True,
+                                                 max_length=max_length)[0]) for text in TEXTS]
+    results = detect_sentiment_batch(TEXTS, nlp_client, batch_size=3)
+    assert len(results) == len(TEXTS)
+    np.testing.assert_allclose(np.array(results), np.array(expected), atol=1e-5)
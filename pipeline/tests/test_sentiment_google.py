@@ -0,0 +1,37 @@
+import threading
+from types import SimpleNamespace
+import pytest
+from pipeline.utils import detect_sentiment_google, google_transient_errors
+from pipeline.executor import RequestExecutor
+
+pytest.importorskip("google.cloud.language_v1")
+from google.api_core.exceptions import TooManyRequests
+
+TEXTS = [f"message {ix}" for ix in range(12)]
+
+
+class FakeLanguageClient:
+    """Natural Language client whose first request for every third text is throttled"""
+    def __init__(self):
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def analyze_sentiment(self, request):
+        text = request["document"]["content"]
+        with self._lock:
+            self.calls[text] = self.calls.get(text, 0) + 1
+            calls = self.calls[text]
+        ix = TEXTS.index(text)
+        if ix % 3 == 0 and calls == 1:
+            raise TooManyRequests("quota exceeded")
+        return SimpleNamespace(document_sentiment=SimpleNamespace(score=ix / 10., magnitude=float(ix)))
+
+
+def test_throttled_requests_are_retried_in_order():
+    client = FakeLanguageClient()
+    executor = RequestExecutor(max_workers=4, backoff=0.01, retry_on=google_transient_errors())
+    results = detect_sentiment_google(TEXTS, client, executor)
+    assert results == [(ix / 10., float(ix)) for ix in range(len(TEXTS))]
+    assert executor.retries == 4
+    assert executor.requests == len(TEXTS)
+    assert client.calls == {text: 2 if ix % 3 == 0 else 1 for ix, text in enumerate(TEXTS)}
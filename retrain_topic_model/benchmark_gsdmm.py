@@ -0,0 +1,65 @@
+import time
+import numpy as np
+import click
+from pipeline.GSDMM import MovieGroupProcess
+
+
+def synthetic_corpus(n_docs, n_topics=20, words_per_topic=200, doc_size=8, noise_words=5000, seed=2018):
+    """short documents drawn from n_topics disjoint word lists, plus one noise word each"""
+    rng = np.random.RandomState(seed)
+    docs = []
+    for _ in range(n_docs):
+        topic = rng.randint(n_topics)
+        words = [f"t{topic}w{w}" for w in rng.randint(words_per_topic, size=doc_size)]
+        words.append(f"noise{rng.randint(noise_words)}")
+        docs.append(words)
+    return docs
+
+
+def run(docs, engine, K, alpha, beta, n_iters, n_jobs=None, sync_every=1, seed=2018):
+    model = MovieGroupProcess(K=K, alpha=alpha, beta=beta, n_iters=n_iters, random_state=seed)
+    start = time.time()
+    model.fit(docs, engine=engine, n_jobs=n_jobs, sync_every=sync_every)
+    duration = time.time() - start
+    print(f'{engine:>10} | {duration:8.1f}s | log-likelihood {model.log_likelihood():14.1f} | '
+          f'{model.cluster_count} clusters | {len(model.history)} likelihood points')
+    return model, duration
+
+
+@click.command()
+@click.option('--data', default="", help='input data file (csv), synthetic corpus if empty')
+@click.option('--textcolumn', default="", help='text column')
+@click.option('--n-docs', default=200000, help='number of documents of the synthetic corpus')
+@click.option('--k', default=20, help='upper bound on the number of clusters')
+@click.option('--alpha', default=0.1)
+@click.option('--beta', default=0.1)
+@click.option('--n-iters', default=20, help='number of sweeps')
+@click.option('--n-jobs', default=None, type=int, help='number of processes of the parallel sampler (all cores if empty)')
+@click.option('--sync-every', default=1, help='sweeps between count reconciliations of the parallel sampler')
+def main(data, textcolumn, n_docs, k, alpha, beta, n_iters, n_jobs, sync_every):
+    """compare convergence and wall-clock time of the sequential and the parallel GSDMM sampler"""
+    if data:
+        import pandas as pd
+        from retrain_topic_model import preprocess
+        text = pd.read_csv(data)[textcolumn].dropna().astype(str)
+        docs = [preprocess(t)[0] for t in text]
+    else:
+        docs = synthetic_corpus(n_docs)
+    print(f'{len(docs)} documents, K={k}, alpha={alpha}, beta={beta}, {n_iters} sweeps')
+
+    sequential, t_sequential = run(docs, "numpy", k, alpha, beta, n_iters)
+    parallel, t_parallel = run(docs, "parallel", k, alpha, beta, n_iters, n_jobs, sync_every)
+    print(f'speedup: {t_sequential / t_parallel:.2f}x')
+
+    print('log-likelihood per iteration (sequential | parallel)')
+    parallel_trace = [h["log_likelihood"] for h in parallel.history]
+    for ix, ll in enumerate([h["log_likelihood"] for h in sequential.history]):
+        # the parallel trace has one point per reconciliation, i.e. every sync_every sweeps
+        synced = (ix + 1) // sync_every
+        ll_parallel = f'{parallel_trace[synced - 1]:14.1f}' \
+            if 0 < synced <= len(parallel_trace) else f'{"-":>14}'
+        print(f'{ix + 1:4d} | {ll:14.1f} | {ll_parallel}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import click
+from pipeline.utils import CustomUnpickler
+
+
+@click.command()
+@click.option('--model', help='input topic model (pickle)')
+@click.option('--output', default="", help='output topic model (npz), same name as input if empty')
+def main(model, output):
+    """convert a gsdmm-model-v*.pickle topic model to the memory-mappable npz format"""
+    if not output:
+        output = model.replace('.pickle', '.npz')
+    with open(model, "rb") as model_file:
+        mgp = CustomUnpickler(model_file).load()
+    mgp.freeze().save(output)
+    print(f'saved {output}')
+
+
+if __name__ == "__main__":
+    main()
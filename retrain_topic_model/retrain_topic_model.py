@@ -2,31 +2,16 @@ import preprocessor as tp
 import pandas as pd
 import numpy as np
 import os
-import operator
-import gensim
 import enchant
 import transformers
-from nltk.stem import WordNetLemmatizer
-from nltk.stem.porter import *
 np.random.seed(2018)
 import nltk
 nltk.download('wordnet')
 import pickle
-stemmer = PorterStemmer()
-from spellchecker import SpellChecker
-spell = SpellChecker()
-from gensim.parsing.preprocessing import STOPWORDS
-STOPWORDS = list(STOPWORDS) # TBI move to config
-STOPWORDS.append('covid')
-STOPWORDS.append('vaccine')
-STOPWORDS.append('vaccines')
-STOPWORDS.append('vaccinated')
-STOPWORDS.append('namibia')
-STOPWORDS.append('says')
-STOPWORDS.append('because')
-STOPWORDS.append('like')
-STOPWORDS.append('get')
-from GSDMM import MovieGroupProcess
+from pipeline.preprocessing import TokenNormalizer, SurfaceFormIndex, SpellCorrector, preprocess_texts
+from pipeline.cache import ResultCache
+from pipeline.utils import topic_model_cache_id
+from pipeline.GSDMM import MovieGroupProcess, Vocabulary
 from tqdm import tqdm
 tqdm.pandas()
 tp.set_options(tp.OPT.URL, tp.OPT.EMOJI, tp.OPT.MENTION)
@@ -34,34 +19,149 @@ en_dict = enchant.Dict("en_US")
 nltk.download('punkt')
 import logging
 import click
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
-class BreakIt(Exception):
-    pass
+normalizer = TokenNormalizer(cache_path="./models/normalizer-cache.json")
 
 
 def preprocess(text):
-    result = []
-    token_list = []
-    for token in gensim.utils.simple_preprocess(text):
-        if len(token) > 2 and 'haha' not in token and token.lower() not in STOPWORDS:
-            result.append(stemmer.stem(WordNetLemmatizer().lemmatize(token, pos='v')))
-            token_list.append(token)
-    return result, dict(zip(result, token_list))
+    return normalizer.preprocess(text)
 
 
-def produce_mapping(mapping_list):
-    mapping_pairs = pd.concat([pd.DataFrame([(k, v) for k, v in d.items()]) for d in mapping_list])
-    mapping_pairs['count'] = 1
-    mapping121 = mapping_pairs.groupby(by=[0, 1]).count().reset_index().sort_values(by=[0, 'count'], ascending=False).groupby(by=0).head(1)
-    mapping12many = mapping_pairs.drop(columns=['count']).drop_duplicates()
-    return mapping121, mapping12many
+def fit_chain(doc_ids, vocabulary, seed, tol=None, stable_clusters=None, K=6, alpha=0.3, beta=0.05, n_iters=500):
+    """fit one GSDMM chain with its own seed on the encoded documents, return model, labels and timing"""
+    start = time.time()
+    model = MovieGroupProcess(K=K, alpha=alpha, beta=beta, n_iters=n_iters, random_state=seed,
+                              tol=tol, stable_clusters=stable_clusters)
+    y = model.fit_encoded(doc_ids, vocabulary=vocabulary)
+    return model, y, time.time() - start
+
+
+def fit_best_chain(doc_ids, vocabulary, chains, workers, seed, tol=None, stable_clusters=None, K=6, alpha=0.3,
+                   beta=0.05, n_iters=500):
+    """fit independent chains on a process pool and keep the one with the highest log-likelihood"""
+    seeds = [seed + chain for chain in range(chains)]
+    with ProcessPoolExecutor(max_workers=min(workers, chains)) as executor:
+        results = list(executor.map(fit_chain, [doc_ids] * chains, [vocabulary] * chains, seeds,
+                                    [tol] * chains, [stable_clusters] * chains, [K] * chains, [alpha] * chains,
+                                    [beta] * chains, [n_iters] * chains))
+
+    chain_stats = []
+    for chain, (model, y, duration) in enumerate(results):
+        chain_stats.append({"chain": chain,
+                            "seed": seeds[chain],
+                            "seconds": duration,
+                            "iterations": len(model.history),
+                            "clusters": model.cluster_count,
+                            "log_likelihood": model.log_likelihood(),
+                            "history": model.history})
+        print(f'chain {chain} (seed {seeds[chain]}): {duration:.1f}s, '
+              f'log-likelihood {chain_stats[-1]["log_likelihood"]:.1f}')
+    best = max(range(chains), key=lambda chain: chain_stats[chain]["log_likelihood"])
+    print(f'keeping chain {best}')
+    model, y, _ = results[best]
+    return model, y, chain_stats
+
+
+# integer-encoded corpus shared by the processes of a hyperparameter sweep
+_sweep_corpus = None
+
+
+def _init_sweep_worker(doc_ids, id2word):
+    global _sweep_corpus
+    word_docs = {}
+    for doc_ix, ids in enumerate(doc_ids):
+        for word in set(ids.tolist()):
+            word_docs.setdefault(word, set()).add(doc_ix)
+    _sweep_corpus = (doc_ids, id2word, {word: ix for ix, word in enumerate(id2word)}, word_docs)
+
+
+def topic_coherence(topics, word2id, word_docs, top_n=10):
+    """mean UMass coherence of the top_n words of each non-empty topic"""
+    scores = []
+    for topic in topics:
+        words = [word2id[word] for word, _ in topic[:top_n]]
+        if len(words) < 2:
+            continue
+        score = 0.
+        for i in range(1, len(words)):
+            for j in range(i):
+                co_docs = len(word_docs[words[i]] & word_docs[words[j]])
+                score += np.log((co_docs + 1) / len(word_docs[words[j]]))
+        scores.append(score)
+    return float(np.mean(scores)) if scores else np.nan
+
+
+def fit_sweep_config(K, alpha, beta, n_iters, seed, tol=None, stable_clusters=None):
+    """fit one configuration of the sweep on the shared encoded corpus, with the stopping rules of single fits"""
+    doc_ids, id2word, word2id, word_docs = _sweep_corpus
+    start = time.time()
+    model = MovieGroupProcess(K=K, alpha=alpha, beta=beta, n_iters=n_iters, random_state=seed, tol=tol,
+                              stable_clusters=stable_clusters)
+    model.fit_encoded(doc_ids, id2word)
+    duration = time.time() - start
+    topics = model.top_words(10)
+    return {"K": K, "alpha": alpha, "beta": beta,
+            "seconds": duration,
+            "iterations": len(model.history),
+            "clusters": model.cluster_count,
+            "log_likelihood": model.log_likelihood(),
+            "coherence": topic_coherence(topics, word2id, word_docs)}
+
+
+def sweep(doc_ids, vocabulary, k_grid, alpha_grid, beta_grid, sample_size, n_iters, workers, seed, tol=None,
+          stable_clusters=None):
+    """fit every combination of K, alpha and beta on a process pool, return one row per configuration"""
+    rng = np.random.RandomState(seed)
+    if 0 < sample_size < len(doc_ids):
+        doc_ids = [doc_ids[ix] for ix in rng.choice(len(doc_ids), sample_size, replace=False)]
+    id2word = vocabulary.id2word
+    configs = [(K, alpha, beta) for K in k_grid for alpha in alpha_grid for beta in beta_grid]
+    print(f'sweeping {len(configs)} configurations on {len(doc_ids)} documents')
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                             initargs=(doc_ids, id2word)) as executor:
+        futures = [executor.submit(fit_sweep_config, K, alpha, beta, n_iters, seed, tol, stable_clusters)
+                   for K, alpha, beta in configs]
+        results = [future.result() for future in futures]
+    return pd.DataFrame(results)
+
+
+def parse_grid(grid, dtype):
+    return [dtype(value) for value in grid.split(',') if value.strip()]
 
 
 @click.command()
 @click.option('--data', help='input data file (csv)')
 @click.option('--textcolumn', help='text column', multiple=True)
-def main(data, textcolumn):
+@click.option('--chains', default=1, help='number of independent GSDMM chains')
+@click.option('--workers', default=os.cpu_count(), help='number of processes used to preprocess the texts and fit the chains')
+@click.option('--seed', default=2018, help='seed of the first chain, following chains use seed+1, seed+2, ...')
+@click.option('--tol', default=1e-4, help='stop when the relative change of log-likelihood stays below tol')
+@click.option('--stable-clusters', default=None, type=int,
+              help='stop when the number of populated clusters does not change for this many iterations')
+@click.option('--k', default=6, help='upper bound on the number of topics')
+@click.option('--alpha', default=0.3, help='prior of the topic sizes, higher values populate more topics')
+@click.option('--beta', default=0.05, help='prior of the topic words, lower values make topics more specific')
+@click.option('--sweep', 'sweep_mode', is_flag=True, help='run a hyperparameter sweep instead of fitting one model')
+@click.option('--k-grid', default="4,6,8,10", help='values of K to sweep (comma-separated)')
+@click.option('--alpha-grid', default="0.1,0.3", help='values of alpha to sweep (comma-separated)')
+@click.option('--beta-grid', default="0.05,0.1", help='values of beta to sweep (comma-separated)')
+@click.option('--sample-size', default=0, help='number of documents sampled for the sweep (all if 0)')
+@click.option('--n-iters', default=500, help='maximum number of iterations of each fit (or chain)')
+@click.option('--chunk-size', default=1000, help='number of texts per preprocessing task')
+@click.option('--min-df', default=2, help='prune words found in fewer documents')
+@click.option('--max-df', default=1.0, help='prune words found in a larger fraction of the documents')
+@click.option('--spell-distance', default=2, help='maximum edit distance of keyword spell correction (1 or 2)')
+@click.option('--spell-time-budget', default=None, type=float,
+              help='seconds spent on keyword spell correction, unlimited if empty')
+@click.option('--spell-skip-known', is_flag=True,
+              help='leave the keywords of the spellchecker dictionary unchanged without caching them')
+def main(data, textcolumn, chains, workers, seed, tol, stable_clusters, k, alpha, beta,
+         sweep_mode, k_grid, alpha_grid, beta_grid, sample_size, n_iters, chunk_size, min_df, max_df,
+         spell_distance, spell_time_budget, spell_skip_known):
 
     print('predicting topic')
     models_path = "./models"
@@ -87,41 +187,55 @@ def main(data, textcolumn):
 
     print(f'found {len_original} valid entries (out of {len(df_tweets)})')
 
-    processed_ser = text.map(preprocess)
-    processed_docs = [item[0] for item in processed_ser]
-    mapping_list = [item[1] for item in processed_ser]
-    mapping121, mapping12many = produce_mapping(mapping_list)
+    processed_docs, mapping_list = preprocess_texts(text, normalizer, n_workers=workers, chunk_size=chunk_size)
+    normalizer.save()
+    surface_forms = SurfaceFormIndex()
+    surface_forms.update(mapping_list)
+    vocabulary = Vocabulary.from_docs(processed_docs, min_df, max_df)
+    doc_ids = vocabulary.encode_docs(processed_docs)
+    print(f'vocabulary of {len(vocabulary)} words')
+
+    if sweep_mode:
+        df_sweep = sweep(doc_ids, vocabulary, parse_grid(k_grid, int), parse_grid(alpha_grid, float),
+                         parse_grid(beta_grid, float), sample_size, n_iters, workers, seed, tol, stable_clusters)
+        df_sweep = df_sweep.sort_values(by=['coherence'], ascending=False)
+        print(df_sweep.to_string(index=False))
+        df_sweep.to_csv(os.path.join(models_path, 'sweep.csv'), index=False)
+        return
 
     # initialize and fit GSDMM model
     print('initialize and fit topic model')
-    model = MovieGroupProcess(K=6, alpha=0.3, beta=0.05, n_iters=500)
-    y = model.fit(processed_docs, len(processed_docs))
-    # save model
+    model, y, chain_stats = fit_best_chain(doc_ids, vocabulary, chains, workers, seed, tol, stable_clusters,
+                                           k, alpha, beta, n_iters)
+    # save model and chain statistics
     pickle.dump(model, open(model_filepath, "wb"))
+    frozen = model.freeze()
+    frozen.save(model_filepath.replace('.pickle', '.npz'))
+    surface_forms.save(SurfaceFormIndex.path_for(model_filepath))
+    with open(model_filepath.replace('.pickle', '-chains.json'), "w") as chains_file:
+        json.dump(chain_stats, chains_file, indent=2)
+    # messages ingested by the model, skipped by the pipeline updates once uploaded to its "cache-blob-directory"
+    cache = ResultCache(os.path.join(models_path, "topic_model-cache.sqlite"), "topic_model")
+    cache.set_many({ResultCache.key(topic_model_cache_id(model_filename), t): int(label) for t, label in zip(text, y)})
+    cache.close()
 
 
     # create list of topic descriptions (lists of keywords) and scores
-    matched_topic_score_list = [model.choose_best_label(i) for i in processed_docs]
-    matched_topic_list = [t[0] for t in matched_topic_score_list]
-    score_list = [t[1] for t in matched_topic_score_list]
+    matched_topic_list, score_list = frozen.choose_best_labels(processed_docs)
+    # the most probable clusters only differ from the last Gibbs assignments where the sampler did not pick them
+    agreement = np.mean(matched_topic_list == np.asarray(y)) if len(y) else 1.
+    print(f'most probable topics match the fit assignments of {agreement * 100:.1f}% of the documents')
     text = pd.DataFrame({'text': text.values, 'topic_num': matched_topic_list, 'score': score_list})
 
     # create list of human-readable topic descriptions (de-lemmatize)
     logging.info('create list of human-readable topics (de-lemmatize)')
-    topic_list = [list(reversed(sorted(x.items(), key=operator.itemgetter(1))[-5:])) for x in model.cluster_word_distribution]
-    topic_list_flat = [[l[0] for l in x] for x in topic_list]
-    topic_list_human_readable = topic_list_flat.copy()
-    for ixt, topic in enumerate(topic_list_human_readable):
-        for ixw, word in enumerate(topic):
-            try:
-                for raw in text.text.values:
-                    for token in gensim.utils.simple_preprocess(raw):
-                        if word in token:
-                            topic_list_human_readable[ixt][ixw] = token
-                            raise BreakIt
-            except BreakIt:
-                pass
-    topic_list_human_readable = [[spell.correction(t) for t in l] for l in topic_list_human_readable]
+    topic_list_human_readable = [[surface_forms.surface_form(word) for word, _ in topic]
+                                 for topic in model.top_words(5)]
+    spell = SpellCorrector(cache_path="./models/spell-cache.json", distance=spell_distance,
+                           time_budget=spell_time_budget,
+                           skip_known=spell_skip_known)
+    topic_list_human_readable = [[spell.correct(t) for t in l] for l in topic_list_human_readable]
+    spell.save()
 
     # create dataframe with best example per topic and topic description
     logging.info('create dataframe with best example per topic and topic description')